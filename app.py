@@ -1,14 +1,28 @@
+import hashlib
+import json
 import os
+import queue
+import threading
+import time
+import traceback
+from datetime import datetime, timezone
+from functools import wraps
 
 from dotenv import load_dotenv
-from flask import Flask, abort, request
+from flask import Flask, Response, abort, jsonify, request, stream_with_context
 from flask_cors import CORS
 
-from src.cohere import summarize as summarize_cohere
-from src.hugging_face import summarize as summarize_hugging_face
-from src.langchain import handle_chat_with_agents
-from src.llama_index import handle_url
-from src.tools import get_available_tools
+from src.hugging_face import warm_up as warm_up_hugging_face
+from src.langchain import QueueCallbackHandler, handle_chat_with_agents
+from src.llama_index import archive_queue, handle_url
+from src.summarization import router as summarization_router
+from src.summarization import serialize_result, summarize, summarize_batch
+from src.tools import get_available_tools, warm_up_tool_router
+from src.tools.notion_registry import notion_tool_registry
+from src.utils import metrics
+from src.utils.cache import create_cache
+from src.utils.jobs import JobManager, JobQueueFull
+from src.utils.singleflight import SingleFlight
 from src.utils.telegram import send_telegram_message
 
 load_dotenv()
@@ -16,6 +30,40 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+url_jobs = JobManager(
+    "url_jobs",
+    max_workers=int(os.getenv("URL_JOB_WORKERS", "4")),
+    max_pending=int(os.getenv("URL_JOB_MAX_PENDING", "100")),
+)
+
+url_flight = SingleFlight("url_flight")
+
+response_cache = create_cache(
+    "response_cache",
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024,
+)
+
+
+# resume archiving articles queued before a restart
+archive_queue.start()
+
+
+def warm_up():
+    try:
+        warm_up_tool_router()
+    except Exception:
+        traceback.print_exc()
+
+    if os.getenv("HF_WARMUP", "false").lower() == "true":
+        try:
+            warm_up_hugging_face()
+        except Exception:
+            traceback.print_exc()
+
+
+if os.getenv("WARMUP_ON_START", "true").lower() == "true":
+    threading.Thread(target=warm_up, daemon=True).start()
+
 
 def check_auth():
     api_key = request.args.get("apiKey", None)
@@ -23,16 +71,85 @@ def check_auth():
         abort(401)
 
 
+def cached_response(endpoint: str, ttl: int):
+    """Cache successful responses of a view by its query args and JSON body.
+
+    Pass `nocache=1` or a `Cache-Control: no-cache` header to skip the lookup,
+    the fresh response still replaces the cached one.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # authenticate before serving anything from the cache
+            check_auth()
+
+            if ttl <= 0:
+                return view(*args, **kwargs)
+
+            query_args = {
+                key: request.args.getlist(key)
+                for key in request.args
+                if key not in ["apiKey", "nocache"]
+            }
+            body = request.get_json(silent=True)
+            key = hashlib.sha256(
+                json.dumps([endpoint, query_args, body], sort_keys=True).encode()
+            ).hexdigest()
+
+            bypass = request.args.get("nocache", "").lower() in ["1", "true"] or (
+                "no-cache" in request.headers.get("Cache-Control", "")
+            )
+            if not bypass:
+                cached = response_cache.get(key)
+                if cached:
+                    cached = json.loads(cached)
+                    response = Response(
+                        cached["body"],
+                        status=cached["status"],
+                        mimetype=cached["mimetype"],
+                    )
+                    response.headers["X-Cache"] = "HIT"
+                    response.headers["Age"] = str(
+                        int(time.time() - cached["created_at"])
+                    )
+                    return response
+
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                response_cache.set(
+                    key,
+                    json.dumps(
+                        {
+                            "body": response.get_data(as_text=True),
+                            "status": response.status_code,
+                            "mimetype": response.mimetype,
+                            "created_at": time.time(),
+                        }
+                    ),
+                    ttl=ttl,
+                )
+            response.headers["X-Cache"] = "BYPASS" if bypass else "MISS"
+            return response
+
+        return wrapper
+
+    return decorator
+
+
 @app.route("/")
 def hello_world():
     return "<p>Hello, World!</p>"
 
 
 @app.route("/api/url", methods=["POST", "GET"])
+@cached_response("url", ttl=int(os.getenv("URL_CACHE_TTL", "86400")))
 def api_url():
     check_auth()
 
-    url = request.args.get("url", None)
+    # several videos or articles can be queried together with repeated `url`
+    urls = [url for url in request.args.getlist("url") if url]
+    url = urls[0] if len(urls) == 1 else urls
     prompt = request.args.get("p", None)
     prompt_type = request.args.get("t", "")
     model_name = request.args.get("m", None)
@@ -41,7 +158,26 @@ def api_url():
     if not prompt:
         return "Prompt is missing!", 400
 
-    result = handle_url(url, prompt, prompt_type, model_name)
+    if request.args.get("async", "").lower() in ["1", "true"]:
+        try:
+            job_id = url_jobs.submit(handle_url, url, prompt, prompt_type, model_name)
+        except JobQueueFull as e:
+            return str(e), 503
+
+        return {
+            "url": url,
+            "job_id": job_id,
+        }, 202
+
+    # identical concurrent requests wait for a single pipeline run
+    result = url_flight.do(
+        (tuple(urls), prompt, prompt_type, model_name),
+        handle_url,
+        url,
+        prompt,
+        prompt_type,
+        model_name,
+    )
     if not result:
         return "Error when processing!", 500
 
@@ -51,21 +187,63 @@ def api_url():
     }
 
 
+@app.route("/api/url/jobs/<job_id>", methods=["GET"])
+def api_url_job(job_id: str):
+    check_auth()
+
+    job = url_jobs.get(job_id)
+    if not job:
+        return "Job not found!", 404
+
+    return job
+
+
+@app.route("/api/metrics", methods=["GET"])
+def api_metrics():
+    check_auth()
+
+    return {
+        **metrics.snapshot(),
+        "summarization_backends": summarization_router.snapshot(),
+    }
+
+
 @app.route("/api/tools", methods=["POST", "GET"])
 def api_tools():
     check_auth()
 
-    return get_available_tools()
+    tools = get_available_tools()
 
+    response = jsonify(tools)
+    response.set_etag(
+        hashlib.sha256(json.dumps(tools, sort_keys=True).encode()).hexdigest()
+    )
+    response.last_modified = datetime.fromtimestamp(
+        notion_tool_registry.last_modified, tz=timezone.utc
+    )
+    return response.make_conditional(request)
 
-@app.route("/api/chat", methods=["POST"])
-def api_chat():
+
+@app.route("/api/tools/reload", methods=["POST"])
+def api_tools_reload():
     check_auth()
+
+    success = notion_tool_registry.refresh()
+    if not success:
+        return "Error when reloading tools!", 502
+
+    return {
+        "success": True,
+        "last_modified": notion_tool_registry.last_modified,
+    }
+
+
+def get_chat_args():
     prompt = request.args.get("p", None)
     if not prompt:
         prompt = request.json.get("p", None)
     if not prompt:
-        return "Prompt is missing!", 400
+        return None
 
     tool_names = request.args.get("t", "")
     # if not tool_names:
@@ -86,9 +264,13 @@ def api_chat():
     actor = request.json.get("actor", "assistant")
     max_iterations = request.json.get("max_iterations", 5)
     chat_history = request.json.get("h", [])
+    # run independent actions of a turn concurrently
+    # JSON true, or "1"/"true" as for the async and nocache args
+    parallel = str(request.json.get("parallel", "")).lower() in ["1", "true"]
+    # read here, the callback may run outside of the request context
+    telegram = request.json.get("telegram", None)
 
     def thoughts_cb(thoughts):
-        telegram = request.json.get("telegram", None)
         if telegram:
             send_telegram_message(
                 bot_id=telegram["bot_id"],
@@ -96,18 +278,68 @@ def api_chat():
                 message="""```\n{}```""".format(thoughts),
             )
 
-    result = handle_chat_with_agents(
-        prompt,
-        chat_history,
-        tool_names,
+    return dict(
+        prompt=prompt,
+        chat_history=chat_history,
+        tool_names=tool_names,
         actor=actor,
         max_iterations=max_iterations,
         thoughts_cb=thoughts_cb,
+        parallel=parallel,
     )
+
+
+@app.route("/api/chat", methods=["POST"])
+def api_chat():
+    check_auth()
+    chat_args = get_chat_args()
+    if not chat_args:
+        return "Prompt is missing!", 400
+
+    result = handle_chat_with_agents(**chat_args)
     return result
 
 
+def format_sse(event: str, data) -> str:
+    return "event: {}\ndata: {}\n\n".format(event, json.dumps(data, default=str))
+
+
+@app.route("/api/chat/stream", methods=["POST"])
+def api_chat_stream():
+    check_auth()
+    chat_args = get_chat_args()
+    if not chat_args:
+        return "Prompt is missing!", 400
+
+    events = queue.Queue()
+
+    def run():
+        try:
+            result = handle_chat_with_agents(
+                **chat_args, callbacks=[QueueCallbackHandler(events)]
+            )
+            events.put({"type": "result", "result": result})
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def generate():
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            yield format_sse(event.pop("type"), event)
+
+    return Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/api/summarize", methods=["POST", "GET"])
+@cached_response("summarize", ttl=int(os.getenv("SUMMARIZE_CACHE_TTL", "86400")))
 def api_summarize():
     check_auth()
 
@@ -117,31 +349,63 @@ def api_summarize():
     if not text:
         return "Text is missing!", 400
 
-    result = None
-
-    if model in ["hugging_face", "hf"]:
-        min_length = request.json.get("min_length", 30)
-        max_length = request.json.get("max_length", 130)
-
-        result = summarize_hugging_face(
-            text,
-            min_length=min_length,
-            max_length=max_length,
-        )
-    else:
-        temperature = request.json.get("temperature", 0.5)
-        length = request.json.get("length", "medium")
-        format = request.json.get("format", "paragraph")
-
-        result = summarize_cohere(
-            text,
-            temperature=float(temperature),
-            length=length,
-            format=format,
-        )
+    result = summarize(text, model, request.json)
     if not result:
         return "Error when processing!", 500
 
     return {
         "result": result,
     }
+
+
+@app.route("/api/summarize/batch", methods=["POST"])
+def api_summarize_batch():
+    """Summarize many texts, streaming NDJSON results as they complete.
+
+    The body is either JSON `{"items": [{"id": ..., "text": ...}], ...options}`
+    or NDJSON with one item per line, options are then read from query args.
+    NDJSON items are identified by their line number when they have no id, an
+    invalid line is reported as an error for that line number.
+    """
+    check_auth()
+
+    model = request.args.get("model", None)
+
+    if request.mimetype in ["application/x-ndjson", "application/jsonl"]:
+        options = {
+            key: value
+            for key, value in request.args.items()
+            if key not in ["apiKey", "model"]
+        }
+
+        def read_items():
+            for number, line in enumerate(request.stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError as e:
+                    # reported as the result of this line, by its line number
+                    yield {"id": number, "error": f"Invalid JSON: {e}"}
+                    continue
+                if not isinstance(item, dict):
+                    yield {"id": number, "error": "Item must be an object!"}
+                    continue
+                item.setdefault("id", number)
+                yield item
+
+        items = read_items()
+    else:
+        body = request.get_json(silent=True) or {}
+        items = body.get("items", None)
+        if not items:
+            return "Items are missing!", 400
+        options = {key: value for key, value in body.items() if key != "items"}
+
+    def generate():
+        for result in summarize_batch(items, model, options):
+            yield json.dumps(result, default=serialize_result) + "\n"
+
+    return Response(
+        stream_with_context(generate()), mimetype="application/x-ndjson"
+    )
@@ -0,0 +1,147 @@
+"""Compare the local summarization backends.
+
+Run from the repository root with a text file of passages separated by
+blank lines:
+
+    python -m scripts.benchmark_summarization data/articles.txt [pytorch quantized onnx]
+
+Each backend runs in its own process so peak RSS is measured separately. It
+reports load time, sequential latency, batched throughput, peak RSS and how
+close its summaries are to the `pytorch` backend (ROUGE-L F1).
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+BATCH_SIZE = 8
+MAX_PASSAGES = 32
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def load_passages(file_path: str):
+    with open(file_path) as f:
+        passages = [p.strip() for p in f.read().split("\n\n") if p.strip()]
+    return passages[:MAX_PASSAGES]
+
+
+def rouge_l(reference: str, candidate: str) -> float:
+    a = reference.split()
+    b = candidate.split()
+    if not a or not b:
+        return 0.0
+    # longest common subsequence, one row at a time
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(
+                previous[j] + 1 if x == y else max(previous[j + 1], current[j])
+            )
+        previous = current
+    lcs = previous[-1]
+    if not lcs:
+        return 0.0
+    precision = lcs / len(b)
+    recall = lcs / len(a)
+    return 2 * precision * recall / (precision + recall)
+
+
+def run_backend(backend: str, file_path: str):
+    """Benchmark a single backend, print the results as JSON."""
+    from src.hugging_face import load_summarizer
+
+    passages = load_passages(file_path)
+
+    start = time.perf_counter()
+    summarizer = load_summarizer(backend)
+    load_seconds = time.perf_counter() - start
+
+    kwargs = dict(min_length=30, max_length=130, do_sample=False, truncation=True)
+
+    # warm up, the first call is always slower
+    summarizer(passages[0], **kwargs)
+
+    latencies = []
+    summaries = []
+    for passage in passages:
+        start = time.perf_counter()
+        output = summarizer(passage, **kwargs)
+        latencies.append(time.perf_counter() - start)
+        summaries.append(output[0]["summary_text"])
+
+    start = time.perf_counter()
+    summarizer(passages, batch_size=BATCH_SIZE, **kwargs)
+    batch_seconds = time.perf_counter() - start
+
+    print(
+        json.dumps(
+            {
+                "backend": backend,
+                "load_seconds": load_seconds,
+                "latency_p50": percentile(latencies, 0.5),
+                "latency_p95": percentile(latencies, 0.95),
+                "throughput": len(passages) / batch_seconds,
+                # kilobytes on Linux
+                "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                / 1024,
+                "summaries": summaries,
+            }
+        )
+    )
+
+
+def run(file_path: str, backends):
+    results = {}
+    for backend in backends:
+        output = subprocess.run(
+            [sys.executable, "-m", "scripts.benchmark_summarization", "--backend"]
+            + [backend, file_path],
+            capture_output=True,
+            text=True,
+            check=True,
+            env=dict(os.environ, TOKENIZERS_PARALLELISM="false"),
+        ).stdout
+        results[backend] = json.loads(output.strip().splitlines()[-1])
+
+    reference = results.get("pytorch")
+    print(
+        "{:<10} {:>8} {:>9} {:>9} {:>11} {:>8} {:>9}".format(
+            "backend", "load s", "p50 s", "p95 s", "texts/s", "RSS MB", "ROUGE-L"
+        )
+    )
+    for backend, result in results.items():
+        agreement = (
+            sum(
+                rouge_l(a, b)
+                for a, b in zip(reference["summaries"], result["summaries"])
+            )
+            / len(result["summaries"])
+            if reference
+            else float("nan")
+        )
+        print(
+            "{:<10} {:>8.1f} {:>9.2f} {:>9.2f} {:>11.2f} {:>8.0f} {:>9.3f}".format(
+                backend,
+                result["load_seconds"],
+                result["latency_p50"],
+                result["latency_p95"],
+                result["throughput"],
+                result["peak_rss_mb"],
+                agreement,
+            )
+        )
+
+
+# run main
+if __name__ == "__main__":
+    if sys.argv[1] == "--backend":
+        run_backend(sys.argv[2], sys.argv[3])
+    else:
+        run(sys.argv[1], sys.argv[2:] or ["pytorch", "quantized", "onnx"])
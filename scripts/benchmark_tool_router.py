@@ -0,0 +1,88 @@
+"""Offline benchmark of tool routing accuracy and latency.
+
+Run from the repository root:
+
+    python -m scripts.benchmark_tool_router [data/tool_routing_queries.json]
+
+Each labeled query lists the tools that are acceptable answers. A query is
+counted as correct at top-1 when the first routed tool is one of them, and
+as recalled when any of the routed tools is.
+"""
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.tools import get_router_entries
+from src.tools.router import get_tool_router
+from src.utils.embedding_cache import get_embeddings
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def evaluate(name, route, queries):
+    correct = 0
+    recalled = 0
+    latencies = []
+    for item in queries:
+        start = time.perf_counter()
+        tools = route(item["query"])
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        if tools and tools[0] in item["tools"]:
+            correct += 1
+        if set(tools) & set(item["tools"]):
+            recalled += 1
+
+    print(
+        "{:<8} top-1 {:>5.1%}  recall@k {:>5.1%}  mean {:>8.2f} ms  p95 {:>8.2f} ms".format(
+            name,
+            correct / len(queries),
+            recalled / len(queries),
+            sum(latencies) / len(latencies),
+            percentile(latencies, 0.95),
+        )
+    )
+
+
+def run(file_path: str):
+    with open(file_path) as f:
+        queries = json.load(f)
+
+    router = get_tool_router(get_router_entries(), get_embeddings())
+    # build or load the vector index and warm the query embeddings up front,
+    # so the numbers reflect steady state latency
+    for item in queries:
+        router.route_vector(item["query"])
+
+    lexical_hits = sum(
+        1
+        for item in queries
+        if router.route_lexical(item["query"])[1] >= router.lexical_threshold
+    )
+
+    print(f"{len(queries)} queries, top_k={router.top_k}")
+    evaluate("lexical", lambda query: router.route_lexical(query)[0], queries)
+    evaluate("vector", router.route_vector, queries)
+    evaluate("hybrid", router.route, queries)
+    print(
+        "hybrid answered {:.1%} of queries without embeddings (threshold {})".format(
+            lexical_hits / len(queries), router.lexical_threshold
+        )
+    )
+
+
+# run main
+if __name__ == "__main__":
+    run(
+        sys.argv[1]
+        if len(sys.argv) > 1
+        else os.path.join(os.path.dirname(__file__), "data", "tool_routing_queries.json")
+    )
@@ -0,0 +1,15 @@
+"""Bulk load the URL Notion database into the local URL index.
+
+Run from the repository root:
+
+    python -m scripts.sync_url_index
+"""
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from src.llama_index import sync_url_index
+
+# run main
+if __name__ == "__main__":
+    print("Synced {} URLs".format(sync_url_index()))
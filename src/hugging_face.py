@@ -1,11 +1,291 @@
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from typing import List
+
 from transformers import pipeline
 
+from .utils import metrics
+from .utils.helper import get_cache_dir
+
+MODEL_NAME = os.getenv("HF_SUMMARIZATION_MODEL", "facebook/bart-large-cnn")
+
+BACKEND = os.getenv("HF_SUMMARIZATION_BACKEND", "pytorch")
+
+# long texts are split in chunks of the model input size minus this margin
+CHUNK_MARGIN_TOKENS = 24
+CHUNK_OVERLAP_TOKENS = int(os.getenv("HF_CHUNK_OVERLAP_TOKENS", "64"))
+MAX_REDUCE_DEPTH = 4
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+
+def get_model_cache_dir(suffix: str) -> str:
+    return os.path.join(
+        get_cache_dir("hugging_face"), MODEL_NAME.replace("/", "--") + suffix
+    )
+
+
+def load_quantized_model():
+    """BART with its linear layers dynamically quantized to int8.
+
+    The quantized weights are cached on disk, later loads build the model
+    from its config and only read the int8 state dict.
+    """
+    import torch
+    from transformers import AutoConfig, AutoModelForSeq2SeqLM
+
+    path = get_model_cache_dir("-int8.pt")
+    if os.path.exists(path):
+        config = AutoConfig.from_pretrained(MODEL_NAME)
+        model = AutoModelForSeq2SeqLM.from_config(config)
+        model = torch.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        model.load_state_dict(torch.load(path))
+        return model.eval()
+
+    model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+    model = torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, path)
+    return model.eval()
+
+
+def load_onnx_model():
+    """BART exported to ONNX and run with ONNX Runtime, cached on disk."""
+    try:
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    except ImportError:
+        raise ValueError(
+            "Could not import optimum python package. "
+            "Please it install it with `pip install optimum[onnxruntime]`."
+        )
+
+    path = get_model_cache_dir("-onnx")
+    if os.path.exists(path):
+        return ORTModelForSeq2SeqLM.from_pretrained(path)
+
+    model = ORTModelForSeq2SeqLM.from_pretrained(MODEL_NAME, export=True)
+    model.save_pretrained(path)
+    return model
+
+
+def load_summarizer(backend: str = None):
+    """Build the summarization pipeline for a backend.
+
+    Backends are `pytorch` (full precision), `quantized` (dynamic int8) and
+    `onnx` (ONNX Runtime), selected with HF_SUMMARIZATION_BACKEND.
+    """
+    backend = (backend or BACKEND).lower()
+    if backend == "pytorch":
+        return pipeline("summarization", model=MODEL_NAME)
+
+    from transformers import AutoTokenizer
+
+    if backend == "quantized":
+        model = load_quantized_model()
+    elif backend == "onnx":
+        model = load_onnx_model()
+    else:
+        raise ValueError(f"Unknown summarization backend: {backend}")
+
+    return pipeline(
+        "summarization",
+        model=model,
+        tokenizer=AutoTokenizer.from_pretrained(MODEL_NAME),
+    )
+
+
+def get_summarizer():
+    """Load the summarization pipeline once per process."""
+    global _summarizer
+    with _summarizer_lock:
+        if _summarizer is None:
+            start = time.perf_counter()
+            _summarizer = load_summarizer()
+            metrics.observe("hf_summarize.load_seconds", time.perf_counter() - start)
+        return _summarizer
+
+
+def warm_up():
+    get_summarizer()
+
+
+def is_loaded() -> bool:
+    return _summarizer is not None
 
-def summarize(text: str, min_length: int = 30, max_length: int = 130):
-    summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
-    return summarizer(
-        text,
-        max_length=max_length,
-        min_length=min_length,
-        do_sample=False,
+
+class SummarizationBatcher:
+    """Group concurrent summarization requests into batched forward passes.
+
+    A batch is sent when it reaches `max_batch_size` or when the oldest
+    request has waited `max_wait` seconds. Requests are batched together only
+    when they share the same generation lengths.
+    """
+
+    def __init__(self, max_batch_size: int = 8, max_wait: float = 0.05) -> None:
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str, min_length: int, max_length: int) -> Future:
+        future = Future()
+        self._queue.put((text, min_length, max_length, future, time.perf_counter()))
+        self._start()
+        return future
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def _start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[1], item[2]), []).append(item)
+
+            for (min_length, max_length), items in groups.items():
+                self._summarize(items, min_length, max_length)
+
+    def _summarize(self, items: List[tuple], min_length: int, max_length: int):
+        start = time.perf_counter()
+        try:
+            outputs = get_summarizer()(
+                [item[0] for item in items],
+                max_length=max_length,
+                min_length=min_length,
+                do_sample=False,
+                truncation=True,
+                batch_size=len(items),
+            )
+        except Exception as e:
+            traceback.print_exc()
+            metrics.incr("hf_summarize.error", len(items))
+            for item in items:
+                item[3].set_exception(e)
+            return
+
+        now = time.perf_counter()
+        metrics.observe("hf_summarize.batch_size", len(items))
+        metrics.observe("hf_summarize.batch_seconds", now - start)
+        for (_, _, _, future, submitted_at), output in zip(items, outputs):
+            metrics.incr("hf_summarize.requests")
+            metrics.observe("hf_summarize.latency_seconds", now - submitted_at)
+            # same shape as calling the pipeline with a single text
+            future.set_result([output])
+
+
+batcher = SummarizationBatcher(
+    max_batch_size=int(os.getenv("HF_MAX_BATCH_SIZE", "8")),
+    max_wait=float(os.getenv("HF_MAX_BATCH_WAIT_MS", "50")) / 1000,
+)
+
+
+def get_max_input_tokens() -> int:
+    # leave room for the special tokens added around each input
+    tokenizer = get_summarizer().tokenizer
+    return min(tokenizer.model_max_length, 1024) - CHUNK_MARGIN_TOKENS
+
+
+def count_tokens(text: str) -> int:
+    tokenizer = get_summarizer().tokenizer
+    return len(tokenizer(text, add_special_tokens=False)["input_ids"])
+
+
+def split_by_tokens(text: str, max_tokens: int, overlap: int = 0) -> List[str]:
+    """Split text in chunks of at most `max_tokens` of the model's tokenizer."""
+    tokenizer = get_summarizer().tokenizer
+    input_ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+    step = max(max_tokens - overlap, 1)
+    return [
+        tokenizer.decode(
+            input_ids[start : start + max_tokens], skip_special_tokens=True
+        )
+        for start in range(0, max(len(input_ids) - overlap, 1), step)
+    ]
+
+
+def summarize_chunks(chunks: List[str], min_length: int, max_length: int) -> List[str]:
+    """Summarize chunks through the batcher, a batch at a time to bound memory."""
+    summaries = []
+    for start in range(0, len(chunks), batcher.max_batch_size):
+        futures = [
+            batcher.submit(chunk, min_length, max_length)
+            for chunk in chunks[start : start + batcher.max_batch_size]
+        ]
+        summaries.extend(future.result()[0]["summary_text"] for future in futures)
+    return summaries
+
+
+def summarize_long(
+    text: str, min_length: int = 30, max_length: int = 130, depth: int = 0
+):
+    """Map-reduce summarization of texts longer than the model's input.
+
+    Chunks are summarized (map), their summaries joined and summarized again
+    (reduce), recursively until the joined summaries fit in one input.
+    """
+    max_tokens = get_max_input_tokens()
+    chunks = split_by_tokens(text, max_tokens, overlap=CHUNK_OVERLAP_TOKENS)
+    if len(chunks) == 1:
+        return batcher.submit(chunks[0], min_length, max_length).result()
+
+    metrics.incr("hf_summarize.map_chunks", len(chunks))
+    # partial summaries can't be longer than the chunk they summarize
+    summaries = summarize_chunks(
+        chunks, min(min_length, max_length), min(max_length, max_tokens)
     )
+    combined = "\n".join(summaries)
+
+    if depth >= MAX_REDUCE_DEPTH:
+        # the summaries don't shrink anymore, summarize what fits
+        chunk = split_by_tokens(combined, max_tokens)[0]
+        return batcher.submit(chunk, min_length, max_length).result()
+
+    return summarize_long(combined, min_length, max_length, depth + 1)
+
+
+def summarize(
+    text: str, min_length: int = 30, max_length: int = 130, chunked: bool = None
+):
+    """Summarize a text, with map-reduce when it's longer than the model input.
+
+    `chunked` forces map-reduce on or off, by default it's used only when
+    the text doesn't fit.
+    """
+    if chunked is None:
+        chunked = count_tokens(text) > get_max_input_tokens()
+    if chunked:
+        return summarize_long(text, min_length=min_length, max_length=max_length)
+    return batcher.submit(text, min_length, max_length).result()
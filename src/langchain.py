@@ -1,65 +1,123 @@
+import os
+import queue
 import re
+import threading
 import traceback
-from typing import Any, List, Union
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from langchain.agents import (
     AgentExecutor,
     AgentOutputParser,
+    BaseMultiActionAgent,
     LLMSingleActionAgent,
     Tool,
 )
+from langchain.agents.tools import InvalidTool
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.callbacks.manager import CallbackManagerForChainRun, Callbacks
 from langchain.chains import LLMChain
 from langchain.chat_models import ChatOpenAI
 from langchain.prompts import BaseChatPromptTemplate
 from langchain.schema import AgentAction, AgentFinish, HumanMessage
+from langchain.tools import BaseTool
 
 from .tools import get_tools, get_tools_by_query
-from .utils.helper import SafeDict, encode_protected_output, is_dev_mode
+from .utils import metrics
+from .utils.helper import (
+    SafeDict,
+    count_tokens,
+    encode_protected_output,
+    is_dev_mode,
+    truncate_tokens,
+)
+
+SCRATCHPAD_MAX_TOKENS = int(os.getenv("SCRATCHPAD_MAX_TOKENS", "2000"))
+TRUNCATED_OBSERVATION_TOKENS = int(os.getenv("TRUNCATED_OBSERVATION_TOKENS", "150"))
+
+# runs the tools of multi-action turns concurrently
+tool_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("AGENT_TOOL_WORKERS", "8")),
+    thread_name_prefix="agent_tool",
+)
+
+
+class Scratchpad:
+    """Agent scratchpad of a single run, rendered incrementally.
+
+    Each (action, observation) step is rendered once. When the scratchpad
+    grows over `max_tokens`, the oldest observations are truncated so late
+    iterations stay within the model's context.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = SCRATCHPAD_MAX_TOKENS,
+        truncated_tokens: int = TRUNCATED_OBSERVATION_TOKENS,
+    ) -> None:
+        self.max_tokens = max_tokens
+        self.truncated_tokens = truncated_tokens
+        # [action log, observation, tokens, truncated]
+        self._steps = []
+        self._tokens = 0
+        self._text = ""
+
+    @staticmethod
+    def _render_step(log: str, observation: str) -> str:
+        return f"{log}\nObservation: {observation}\nThought: "
+
+    def render(self, intermediate_steps: List) -> str:
+        for action, observation in intermediate_steps[len(self._steps) :]:
+            step = self._render_step(action.log, observation)
+            tokens = count_tokens(step)
+            self._steps.append([action.log, str(observation), tokens, False])
+            self._tokens += tokens
+            self._text += step
+
+        if self._tokens > self.max_tokens:
+            self._truncate()
+
+        return self._text
+
+    def _truncate(self):
+        # never truncate the latest observation, the agent still needs it
+        for step in self._steps[:-1]:
+            if self._tokens <= self.max_tokens:
+                break
+            log, observation, tokens, truncated = step
+            if truncated:
+                continue
+
+            observation = truncate_tokens(observation, self.truncated_tokens)
+            new_tokens = count_tokens(self._render_step(log, observation))
+            step[1:] = [observation, new_tokens, True]
+            self._tokens += new_tokens - tokens
+
+        self._text = "".join(
+            self._render_step(log, observation)
+            for log, observation, _, _ in self._steps
+        )
 
 
 # Set up a prompt template
 class CustomPromptTemplate(BaseChatPromptTemplate):
-    # The template to use
+    # The template to use, with the tools already rendered into it
     template: str
-    # The list of tools available
-    tools: List[Tool]
-    # Chat history
-    chat_history: List[str]
-    # Thoughts callback
-    thoughts_cb: Any
-
-    def __init_subclass__(
-        cls, chat_history: List[str], thoughts_cb: Any, *args, **kwargs
-    ) -> None:
-        cls.chat_history = chat_history
-        cls.thoughts_cb = thoughts_cb
-        return super().__init_subclass__(*args, **kwargs)
 
     def format_messages(self, **kwargs) -> str:
         # Get the intermediate steps (AgentAction, Observation tuples)
         # Format them in a particular way
         intermediate_steps = kwargs.pop("intermediate_steps")
-        thoughts = ""
-        latest_thoughts = ""
-        for action, observation in intermediate_steps:
-            thoughts += action.log
-            thoughts += f"\nObservation: {observation}\nThought: "
-            latest_thoughts = f"{action.log}\n\nObservation: {observation}"
+        scratchpad = kwargs.pop("scratchpad", None) or Scratchpad()
         # Set the agent_scratchpad variable to that value
-        kwargs["agent_scratchpad"] = thoughts
-        if self.thoughts_cb:
-            self.thoughts_cb(latest_thoughts.strip())
+        kwargs["agent_scratchpad"] = scratchpad.render(intermediate_steps)
 
-        # Create a tools variable from the list of tools provided
-        kwargs["tools"] = "\n".join(
-            [f"{tool.name}: {tool.description}" for tool in self.tools]
-        )
-        # Create a list of tool names for the tools provided
-        kwargs["tool_names"] = ", ".join([tool.name for tool in self.tools])
         # Create a chat_history variable from the chat history provided
-        if self.chat_history:
+        chat_history = kwargs.pop("chat_history", None)
+        if chat_history:
             kwargs["chat_history"] = "Previous conversation history:\n" + "\n".join(
-                self.chat_history
+                chat_history
             )
         else:
             kwargs["chat_history"] = ""
@@ -69,6 +127,98 @@ class CustomPromptTemplate(BaseChatPromptTemplate):
         return [HumanMessage(content=formatted)]
 
 
+class ThoughtsCallbackHandler(BaseCallbackHandler):
+    """Call `thoughts_cb` with each action and its observation.
+
+    The actions of a turn may run concurrently, so each tool run is matched
+    to its action when it starts and reported by its `run_id` when it ends.
+    """
+
+    def __init__(self, thoughts_cb: Any) -> None:
+        self.thoughts_cb = thoughts_cb
+        self._lock = threading.Lock()
+        # actions announced by the agent whose tool hasn't started yet
+        self._pending = []
+        # tool run_id -> action
+        self._running = {}
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        with self._lock:
+            self._pending.append(action)
+
+    def on_tool_start(
+        self, serialized: Dict[str, Any], input_str: str, *, run_id, **kwargs: Any
+    ) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            # an unknown tool runs as InvalidTool, fall back to the oldest action
+            action = next(
+                (
+                    action
+                    for action in self._pending
+                    if action.tool == serialized.get("name")
+                    and str(action.tool_input) == input_str
+                ),
+                self._pending[0],
+            )
+            self._pending.remove(action)
+            self._running[run_id] = action
+
+    def on_tool_end(self, output: str, *, run_id, **kwargs: Any) -> None:
+        with self._lock:
+            action = self._running.pop(run_id, None)
+        if action:
+            self.thoughts_cb(f"{action.log}\n\nObservation: {output}".strip())
+
+    def on_tool_error(self, error: BaseException, *, run_id, **kwargs: Any) -> None:
+        with self._lock:
+            self._running.pop(run_id, None)
+
+
+class QueueCallbackHandler(BaseCallbackHandler):
+    """Push agent steps and final answer tokens into a queue as they happen."""
+
+    FINAL_ANSWER_PREFIX = "Final Answer:"
+
+    def __init__(self, events: queue.Queue) -> None:
+        self.events = events
+        self._buffer = ""
+        self._answer_started = False
+
+    def on_llm_start(
+        self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any
+    ) -> None:
+        self._buffer = ""
+        self._answer_started = False
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages, **kwargs):
+        self.on_llm_start(serialized, [], **kwargs)
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self._buffer += token
+        if self._answer_started:
+            self.events.put({"type": "token", "token": token})
+        elif self.FINAL_ANSWER_PREFIX in self._buffer:
+            self._answer_started = True
+            answer = self._buffer.split(self.FINAL_ANSWER_PREFIX, 1)[1].lstrip()
+            if answer:
+                self.events.put({"type": "token", "token": answer})
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        self.events.put(
+            {
+                "type": "action",
+                "tool": action.tool,
+                "tool_input": action.tool_input,
+                "log": action.log,
+            }
+        )
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        self.events.put({"type": "observation", "observation": output})
+
+
 class CustomOutputParser(AgentOutputParser):
     def parse(self, llm_output: str) -> Union[AgentAction, AgentFinish]:
         # Check if agent should finish
@@ -91,18 +241,136 @@ class CustomOutputParser(AgentOutputParser):
         # Return the action and action input
         return AgentAction(tool=action, tool_input=action_input, log=llm_output)
 
+    def parse_all(self, llm_output: str) -> Union[List[AgentAction], AgentFinish]:
+        """Parse every Action/Action Input pair of a single LLM turn."""
+        if "Final Answer:" in llm_output:
+            return self.parse(llm_output)
 
-def handle_chat_with_agents(
-    prompt: str,
-    chat_history: List[str],
-    tool_names: List[str],
-    actor: str = "assistant",
-    max_iterations: int = 15,
-    thoughts_cb: Any = None,
-):
-    try:
-        # Set up the base template
-        template = """Act as a {actor} and have a conversation with a human. Answer the following questions as best you can. 
+        # an input ends at the next Thought or Action line
+        regex = (
+            r"Action: (.*?)[\n]*Action Input:[\s]*(.*?)"
+            r"(?=\n\s*(?:Thought|Action):|\Z)"
+        )
+        actions = []
+        log_start = 0
+        for match in re.finditer(regex, llm_output, re.DOTALL):
+            action = match.group(1).strip()
+            action_input = match.group(2).strip().strip('"')
+            # each action keeps its own slice of the output as log, so the
+            # scratchpad reads as one action followed by its observation
+            log = llm_output[log_start : match.end()]
+            log_start = match.end()
+            actions.append(AgentAction(tool=action, tool_input=action_input, log=log))
+
+        if not actions:
+            raise ValueError(f"Could not parse LLM output: `{llm_output}`")
+
+        return actions
+
+
+class CustomMultiActionAgent(BaseMultiActionAgent):
+    """Agent that can return several independent actions in one turn."""
+
+    llm_chain: LLMChain
+    output_parser: CustomOutputParser
+    stop: List[str]
+
+    @property
+    def input_keys(self) -> List[str]:
+        return list(set(self.llm_chain.input_keys) - {"intermediate_steps"})
+
+    def plan(
+        self,
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> Union[List[AgentAction], AgentFinish]:
+        output = self.llm_chain.run(
+            intermediate_steps=intermediate_steps,
+            stop=self.stop,
+            callbacks=callbacks,
+            **kwargs,
+        )
+        return self.output_parser.parse_all(output)
+
+    async def aplan(
+        self,
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> Union[List[AgentAction], AgentFinish]:
+        output = await self.llm_chain.arun(
+            intermediate_steps=intermediate_steps,
+            stop=self.stop,
+            callbacks=callbacks,
+            **kwargs,
+        )
+        return self.output_parser.parse_all(output)
+
+    def tool_run_logging_kwargs(self) -> Dict:
+        return {"llm_prefix": "Thought: ", "observation_prefix": "\nObservation: "}
+
+
+class ParallelAgentExecutor(AgentExecutor):
+    """Agent executor running all actions of a turn concurrently.
+
+    Observations are returned in the same order as the actions.
+    """
+
+    def _take_next_step(
+        self,
+        name_to_tool_map: Dict[str, BaseTool],
+        color_mapping: Dict[str, str],
+        inputs: Dict[str, str],
+        intermediate_steps: List[Tuple[AgentAction, str]],
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Union[AgentFinish, List[Tuple[AgentAction, str]]]:
+        output = self.agent.plan(
+            intermediate_steps,
+            callbacks=run_manager.get_child() if run_manager else None,
+            **inputs,
+        )
+        if isinstance(output, AgentFinish):
+            return output
+
+        actions = [output] if isinstance(output, AgentAction) else output
+        for action in actions:
+            if run_manager:
+                run_manager.on_agent_action(action, color="green")
+
+        def run_action(action: AgentAction) -> str:
+            tool_run_kwargs = self.agent.tool_run_logging_kwargs()
+            if action.tool not in name_to_tool_map:
+                return InvalidTool().run(
+                    action.tool,
+                    verbose=self.verbose,
+                    color=None,
+                    callbacks=run_manager.get_child() if run_manager else None,
+                    **tool_run_kwargs,
+                )
+
+            tool = name_to_tool_map[action.tool]
+            if tool.return_direct:
+                tool_run_kwargs["llm_prefix"] = ""
+            return tool.run(
+                action.tool_input,
+                verbose=self.verbose,
+                color=color_mapping[action.tool],
+                callbacks=run_manager.get_child() if run_manager else None,
+                **tool_run_kwargs,
+            )
+
+        if len(actions) == 1:
+            observations = [run_action(actions[0])]
+        else:
+            metrics.incr("agent.parallel_actions", len(actions))
+            observations = list(tool_executor.map(run_action, actions))
+
+        return list(zip(actions, observations))
+
+
+# Set up the base template
+TEMPLATE = """Act as a {actor} and have a conversation with a human. Answer the following questions as best you can. 
 
 You have access to the following tools:
 
@@ -116,7 +384,7 @@ Action: the action to take, only be one of [{tool_names}], don't include other w
 Action Input: the input to the action
 Observation: the result of the action
 ... (this Thought/Action/Action Input/Observation can repeat N times)
-Thought: I now know the final answer
+{parallel_instructions}Thought: I now know the final answer
 Final Answer: the final answer to the original input question
 
 Begin! Remember to speak as a {actor} when giving your final answer. If you are sure you have the final answer or no action needed, you must respond "Final Answer: <answer>" in question's language in this final answer only. If you are not sure, you can continue to use the tools.
@@ -124,25 +392,69 @@ Begin! Remember to speak as a {actor} when giving your final answer. If you are
 {chat_history}
 
 Question: {input}
-{agent_scratchpad}""".format_map(
-            SafeDict(actor=actor)
-        )
+{agent_scratchpad}"""
 
-        llm = ChatOpenAI(temperature=0)
+MAX_AGENT_RUNTIMES = int(os.getenv("MAX_AGENT_RUNTIMES", "64"))
 
-        if not tool_names:
-            tools = get_tools_by_query(prompt, llm=llm)
-        else:
-            tools = get_tools(tool_names, llm=llm)
+
+PARALLEL_INSTRUCTIONS = """When you need several lookups that don't depend on each other, write all their Action/Action Input pairs one after another before the Observation, they will run at the same time.
+"""
+
+
+def escape_braces(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+_llms = {}
+_runtimes = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_llm(streaming: bool = False) -> ChatOpenAI:
+    with _lock:
+        if streaming not in _llms:
+            _llms[streaming] = ChatOpenAI(temperature=0, streaming=streaming)
+        return _llms[streaming]
+
+
+class AgentRuntime:
+    """Prebuilt prompt, LLM chain and agent for a tool set and actor.
+
+    A runtime holds no per-request state, chat history and callbacks are
+    passed to `run` so one instance can serve concurrent requests.
+    """
+
+    def __init__(
+        self, tools: List[Tool], actor: str, llm: ChatOpenAI, parallel: bool = False
+    ) -> None:
+        self.tools = tools
+        self.parallel = parallel
+
+        # Render the tools block once for this tool set, escaping braces
+        # so descriptions survive the per-iteration `format` call
+        tools_block = "\n".join(
+            [f"{tool.name}: {tool.description}" for tool in tools]
+        )
+        tool_names = ", ".join([tool.name for tool in tools])
+        template = TEMPLATE.format_map(
+            SafeDict(
+                actor=actor,
+                tools=escape_braces(tools_block),
+                tool_names=escape_braces(tool_names),
+                parallel_instructions=PARALLEL_INSTRUCTIONS if parallel else "",
+            )
+        )
 
         prompt_template = CustomPromptTemplate(
-            chat_history=chat_history,
-            thoughts_cb=thoughts_cb,
             template=template,
-            tools=tools,
-            # This omits the `agent_scratchpad`, `tools`, and `tool_names` variables because those are generated dynamically
+            # This omits the `agent_scratchpad` variable because it is generated dynamically
             # This includes the `intermediate_steps` variable because that is needed
-            input_variables=["input", "intermediate_steps"],
+            input_variables=[
+                "input",
+                "intermediate_steps",
+                "chat_history",
+                "scratchpad",
+            ],
         )
 
         output_parser = CustomOutputParser()
@@ -153,23 +465,110 @@ Question: {input}
             prompt=prompt_template,
         )
 
-        tool_names = [tool.name for tool in tools]
-        agent = LLMSingleActionAgent(
-            llm_chain=llm_chain,
-            output_parser=output_parser,
-            stop=["\nObservation:"],
-            allowed_tools=tool_names,
-        )
+        if parallel:
+            self.agent = CustomMultiActionAgent(
+                llm_chain=llm_chain,
+                output_parser=output_parser,
+                stop=["\nObservation:"],
+            )
+        else:
+            self.agent = LLMSingleActionAgent(
+                llm_chain=llm_chain,
+                output_parser=output_parser,
+                stop=["\nObservation:"],
+                allowed_tools=[tool.name for tool in tools],
+            )
 
-        agent_executor = AgentExecutor.from_agent_and_tools(
-            agent=agent,
-            tools=tools,
+    def run(
+        self,
+        prompt: str,
+        chat_history: List[str],
+        max_iterations: int,
+        callbacks: Optional[List[BaseCallbackHandler]] = None,
+    ) -> dict:
+        executor_class = ParallelAgentExecutor if self.parallel else AgentExecutor
+        agent_executor = executor_class.from_agent_and_tools(
+            agent=self.agent,
+            tools=self.tools,
             max_iterations=max_iterations,
             return_intermediate_steps=True,
             verbose=is_dev_mode(),
         )
 
-        result = agent_executor({"input": encode_protected_output(prompt)})
+        input = encode_protected_output(prompt)
+        outputs = agent_executor(
+            {
+                "input": input,
+                "chat_history": chat_history,
+                "scratchpad": Scratchpad(),
+            },
+            return_only_outputs=True,
+            callbacks=callbacks,
+        )
+        return {"input": input, **outputs}
+
+
+def get_agent_runtime(
+    tools: List[Tool], actor: str, streaming: bool, parallel: bool = False
+) -> AgentRuntime:
+    key = (
+        actor,
+        streaming,
+        parallel,
+        tuple((tool.name, tool.description) for tool in tools),
+    )
+    with _lock:
+        runtime = _runtimes.get(key)
+        if runtime:
+            _runtimes.move_to_end(key)
+            metrics.incr("agent_runtime.hit")
+            return runtime
+
+    metrics.incr("agent_runtime.miss")
+    runtime = AgentRuntime(tools, actor, get_llm(streaming), parallel=parallel)
+
+    with _lock:
+        runtime = _runtimes.setdefault(key, runtime)
+        while len(_runtimes) > MAX_AGENT_RUNTIMES:
+            _runtimes.popitem(last=False)
+    return runtime
+
+
+def handle_chat_with_agents(
+    prompt: str,
+    chat_history: List[str],
+    tool_names: List[str],
+    actor: str = "assistant",
+    max_iterations: int = 15,
+    thoughts_cb: Any = None,
+    callbacks: Optional[List[BaseCallbackHandler]] = None,
+    parallel: bool = False,
+):
+    try:
+        callbacks = list(callbacks or [])
+        # stream tokens only when someone is listening to them
+        streaming = bool(callbacks)
+        if thoughts_cb:
+            callbacks.append(ThoughtsCallbackHandler(thoughts_cb))
+
+        llm = get_llm(streaming)
+
+        if not tool_names:
+            tools = get_tools_by_query(prompt, llm=llm)
+        else:
+            tools = get_tools(tool_names, llm=llm)
+
+        # multi-action agents can't use `return_direct` tools (giphy, replicate)
+        parallel = parallel and not any(tool.return_direct for tool in tools)
+
+        runtime = get_agent_runtime(tools, actor, streaming, parallel=parallel)
+
+        result = runtime.run(
+            prompt,
+            chat_history,
+            max_iterations=max_iterations,
+            callbacks=callbacks,
+        )
         result["success"] = True
 
         return result
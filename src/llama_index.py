@@ -1,9 +1,14 @@
+import hashlib
+import json
 import os
 import re
+import threading
 import traceback
-from typing import List, Literal
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Literal, Union
 
 import requests
+from googleapiclient.discovery import build
 from newspaper import Article
 from youtube_transcript_api import YouTubeTranscriptApi
 
@@ -12,67 +17,103 @@ from langchain.chat_models import ChatOpenAI
 from llama_index import (
     Document,
     GPTSimpleVectorIndex,
+    LangchainEmbedding,
     LLMPredictor,
     NotionPageReader,
     PromptHelper,
     ServiceContext,
 )
 from llama_index.readers.schema.base import Document
-from .utils.notion import query_database, create_page
+from .utils import metrics
+from .utils.embedding_cache import get_embeddings
+from .utils.helper import get_cache_dir
+from .utils.index_store import index_store
+from .utils.notion import (
+    create_page_with_blocks,
+    iter_database,
+    text_to_blocks,
+)
+from .utils.singleflight import SingleFlight
+from .utils.url_index import normalize_url, url_index
+from .utils.write_behind import WriteBehindQueue
 
 
 NOTION_API_KEY = os.getenv("NOTION_API_KEY")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+MAX_PLAYLIST_VIDEOS = int(os.getenv("MAX_PLAYLIST_VIDEOS", "25"))
+
+TRANSCRIPT_WINDOW_SECONDS = int(os.getenv("TRANSCRIPT_WINDOW_SECONDS", "300"))
+
 notion_database_id = os.getenv("URL_NOTION_DATABASE_ID")
 
+url_index_flight = SingleFlight("url_index_flight")
+
 
 def get_notion_item(url: str):
+    # look the page up locally first, Notion is only queried on a miss
+    local = url_index.get(url)
+    if local:
+        return {"id": local[0]}
+
     filter_db = {"and": [{"property": "URL", "url": {"equals": url}}]}
 
-    result = query_database(notion_database_id, filter_db)
-
-    return None if not result["results"] else result["results"][0]
-
-
-def create_notion_item(article: Article):
-    def text_to_blocks():
-        lines = article.text.split("\n")
-        blocks = []
-
-        for line in lines:
-            if line:
-                blocks.append(
-                    {
-                        "object": "block",
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [
-                                {
-                                    "type": "text",
-                                    "text": {
-                                        "content": line,
-                                    },
-                                }
-                            ]
-                        },
-                    }
-                )
-
-        return blocks
-
-    result = create_page(
+    item = next(iter_database(notion_database_id, filter_db, page_size=1), None)
+    if item:
+        url_index.put(url, item["id"])
+    return item
+
+
+def sync_url_index() -> int:
+    """Load every page of the URL database into the local URL index."""
+    count = 0
+    batch = []
+    for row in iter_database(notion_database_id):
+        url = row["properties"]["URL"]["url"]
+        if not url:
+            continue
+        batch.append((url, row["id"], None))
+        if len(batch) >= 100:
+            url_index.put_many(batch)
+            count += len(batch)
+            batch = []
+    url_index.put_many(batch)
+    return count + len(batch)
+
+
+def create_notion_item(title: str, url: str, text: str):
+    result = create_page_with_blocks(
         parent={"database_id": notion_database_id},
         properties={
-            "Title": {"title": [{"text": {"content": article.title}}]},
-            "URL": {"url": article.url},
+            "Title": {"title": [{"text": {"content": title}}]},
+            "URL": {"url": url},
         },
-        children=text_to_blocks(),
+        blocks=text_to_blocks(text),
     )
+    if "id" not in result:
+        raise ValueError(f"Got error from Notion: {result.get('message')}")
+
+    url_index.put(url, result["id"], hashlib.sha256(text.encode()).hexdigest())
     return result
 
 
+def archive_article(payload: dict):
+    # the page may exist already if a previous attempt timed out after creating it
+    if get_notion_item(payload["url"]):
+        return
+    create_notion_item(payload["title"], payload["url"], payload["text"])
+
+
+archive_queue = WriteBehindQueue(
+    "notion_archive",
+    os.path.join(get_cache_dir("notion"), "archive_queue.sqlite3"),
+    handler=archive_article,
+)
+
+
 def get_index(
     documents: List[Document],
     model_name: str,
@@ -108,13 +149,39 @@ def get_index(
         ),
     )
 
+    # embed through the shared local cache, misses are sent upstream in batches
+    embeddings = get_embeddings()
+    embed_model = LangchainEmbedding(embeddings, embed_batch_size=100)
+
     service_context = ServiceContext.from_defaults(
-        llm_predictor=llm_predictor, prompt_helper=prompt_helper
+        llm_predictor=llm_predictor,
+        prompt_helper=prompt_helper,
+        embed_model=embed_model,
     )
 
+    # reuse a saved index when the same content was indexed with the same chunking
+    index_key = index_store.make_key(
+        [document.get_text() for document in documents],
+        extra_info=[document.extra_info for document in documents],
+        max_input_size=max_input_size,
+        num_outputs=num_outputs,
+        max_chunk_overlap=max_chunk_overlap,
+        chunk_size_limit=chunk_size_limit,
+        embedding_model=embeddings.model,
+    )
+    index = index_store.load(
+        index_key,
+        lambda path: GPTSimpleVectorIndex.load_from_disk(
+            path, service_context=service_context
+        ),
+    )
+    if index:
+        return index
+
     index = GPTSimpleVectorIndex.from_documents(
         documents, service_context=service_context
     )
+    index_store.save(index_key, index.save_to_disk)
     return index
 
 
@@ -127,33 +194,88 @@ def get_notion_documents(
     return documents
 
 
-def handle_url(
-    url: str,
-    prompt: str,
-    prompt_type: Literal["summarize", "qa"],
-    model_name: str,
-):
-    try:
+def get_article_documents(url: str, progress: Any):
+    # still waiting to be archived to Notion
+    pending = archive_queue.pending(normalize_url(url))
+    if pending:
+        return [Document(pending["text"])]
+
+    progress("notion_lookup")
+    item = get_notion_item(url)
+
+    if item:
+        # cold article that only lives in Notion
+        progress("notion_read")
+        return get_notion_documents([item["id"]])
+
+    progress("download")
+    article = Article(url)
+    article.download()
+    article.parse()
+    # article.nlp()
+
+    # index the parsed text right away, Notion is written in the background
+    archive_queue.enqueue(
+        normalize_url(url),
+        {"title": article.title, "url": url, "text": article.text},
+    )
+    return [Document(article.text)]
+
+
+def get_url_documents(urls: List[str], progress: Any):
+    video_ids = []
+    documents = []
+    for url in urls:
         video_id = get_youtube_video_id(url)
+        playlist_id = None if video_id else get_youtube_playlist_id(url)
         if video_id:
-            documents = get_documents(ids=[video_id], languages=["en", "vi"])
-
+            video_ids.append(video_id)
+        elif playlist_id:
+            progress("playlist")
+            video_ids.extend(get_youtube_playlist_video_ids(playlist_id))
         else:
             # normal URL
-            item = get_notion_item(url)
+            documents.extend(get_article_documents(url, progress))
 
-            if not item:
-                article = Article(url)
-                article.download()
-                article.parse()
-                # article.nlp()
+    if video_ids:
+        progress("transcript")
+        transcripts, errors = get_documents(ids=video_ids, languages=["en", "vi"])
+        documents.extend(transcripts)
+        # only fail when the URLs gave nothing to index at all
+        if errors and not documents:
+            raise errors[0]
 
-                item = create_notion_item(article)
+    return documents
 
-            documents = get_notion_documents([item["id"]])
 
-        index = get_index(documents, model_name)
+def get_url_index(urls: List[str], model_name: str, progress: Any):
+    documents = get_url_documents(urls, progress)
 
+    progress("index")
+    return get_index(documents, model_name)
+
+
+def handle_url(
+    url: Union[str, List[str]],
+    prompt: str,
+    prompt_type: Literal["summarize", "qa"],
+    model_name: str,
+    progress_cb: Any = None,
+):
+    def progress(stage: str):
+        if progress_cb:
+            progress_cb(stage)
+
+    urls = [url] if isinstance(url, str) else list(url)
+
+    try:
+        # requests for the same URLs share one fetch, Notion write and index
+        # build, the model isn't part of the key as the index doesn't use it
+        index = url_index_flight.do(
+            tuple(urls), get_url_index, urls, model_name, progress
+        )
+
+        progress("query")
         response_mode = "tree_summarize" if prompt_type == "summarize" else "default"
         response = index.query(prompt + "\n", response_mode=response_mode)
         return response.response.strip()
@@ -174,12 +296,136 @@ def get_youtube_video_id(url: str):
     return None
 
 
+def get_youtube_playlist_id(url: str):
+    regex = r"(?:https?:\/\/)?(?:[0-9A-Z-]+\.)?(?:youtube|youtube-nocookie)\.com\/.*[?&]list=([\w-]+)"
+
+    match = re.match(regex, url, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+def get_youtube_playlist_video_ids(playlist_id: str) -> List[str]:
+    youtube = build(
+        "youtube", "v3", developerKey=GOOGLE_API_KEY, cache_discovery=False
+    )
+
+    video_ids = []
+    page_token = None
+    while len(video_ids) < MAX_PLAYLIST_VIDEOS:
+        response = (
+            youtube.playlistItems()
+            .list(
+                part="contentDetails",
+                playlistId=playlist_id,
+                maxResults=50,
+                pageToken=page_token,
+            )
+            .execute()
+        )
+        video_ids.extend(
+            item["contentDetails"]["videoId"] for item in response["items"]
+        )
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+    return video_ids[:MAX_PLAYLIST_VIDEOS]
+
+
+def get_transcript(video_id: str, languages: List[str]):
+    """Return (language, transcript segments) of a video, cached on disk.
+
+    Cached languages are tried in order of preference before asking YouTube.
+    """
+    directory = get_cache_dir("transcripts")
+    for language in languages:
+        path = os.path.join(directory, f"{video_id}.{language}.json")
+        if os.path.exists(path):
+            metrics.incr("transcript_cache.hit")
+            with open(path) as f:
+                return language, json.load(f)
+
+    metrics.incr("transcript_cache.miss")
+    transcript = YouTubeTranscriptApi.list_transcripts(video_id).find_transcript(
+        languages
+    )
+    segments = transcript.fetch()
+
+    path = os.path.join(directory, f"{video_id}.{transcript.language_code}.json")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(segments, f)
+    os.replace(tmp_path, path)
+
+    return transcript.language_code, segments
+
+
+def format_timestamp(seconds: float) -> str:
+    seconds = int(seconds)
+    return "{:02d}:{:02d}:{:02d}".format(
+        seconds // 3600, seconds % 3600 // 60, seconds % 60
+    )
+
+
+def transcript_to_documents(video_id: str, language: str, segments: List[dict]):
+    """Group transcript segments in documents of `TRANSCRIPT_WINDOW_SECONDS`.
+
+    Each document keeps its video and time range as extra info.
+    """
+    documents = []
+    lines = []
+    window_start = 0.0
+
+    def flush(end: float):
+        documents.append(
+            Document(
+                "\n".join(lines),
+                extra_info={
+                    "video_id": video_id,
+                    "language": language,
+                    "start": format_timestamp(window_start),
+                    "end": format_timestamp(end),
+                },
+            )
+        )
+
+    for segment in segments:
+        if lines and segment["start"] - window_start >= TRANSCRIPT_WINDOW_SECONDS:
+            flush(segment["start"])
+            lines = []
+            window_start = segment["start"]
+        lines.append(segment["text"])
+
+    if lines:
+        last = segments[-1]
+        flush(last["start"] + last.get("duration", 0))
+    return documents
+
+
 def get_documents(ids: List[str], languages: List[str]):
+    """Return the transcript documents of videos and the errors of failed ones.
+
+    Playlists often contain videos without captions, so failed videos are
+    skipped, the caller decides whether anything useful is left.
+    """
+
+    def fetch(id: str):
+        try:
+            return get_transcript(id, languages), None
+        except Exception as e:
+            traceback.print_exc()
+            metrics.incr("transcript.failed")
+            return None, e
+
+    # fetch all transcripts concurrently, documents keep the order of ids
+    with ThreadPoolExecutor(max_workers=min(len(ids), 8) or 1) as executor:
+        transcripts = list(executor.map(fetch, ids))
+
     results = []
-    for id in ids:
-        srt = YouTubeTranscriptApi.get_transcript(id, languages=languages)
-        transcript = ""
-        for chunk in srt:
-            transcript = transcript + chunk["text"] + "\n"
-        results.append(Document(transcript))
-    return results
+    errors = []
+    for id, (transcript, error) in zip(ids, transcripts):
+        if error:
+            errors.append(error)
+            continue
+        language, segments = transcript
+        results.extend(transcript_to_documents(id, language, segments))
+    return results, errors
@@ -0,0 +1,259 @@
+import os
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Iterable, Iterator, List
+
+from . import hugging_face
+from .cohere import summarize as summarize_cohere
+from .hugging_face import batcher
+from .hugging_face import summarize as summarize_hugging_face
+from .utils import metrics
+
+HUGGING_FACE_MODELS = ["hugging_face", "hf"]
+
+COHERE_BATCH_CONCURRENCY = int(os.getenv("COHERE_BATCH_CONCURRENCY", "4"))
+
+# Cohere rejects texts under 250 characters and truncates past its context
+COHERE_MIN_CHARACTERS = 250
+COHERE_MAX_TOKENS = int(os.getenv("COHERE_SUMMARIZE_MAX_TOKENS", "25000"))
+
+# BART input size, used until the model is loaded to count tokens exactly
+HF_MAX_INPUT_TOKENS = 1000
+
+# p95 latency each backend should stay under, in seconds
+LATENCY_SLOS = {
+    "hf": float(os.getenv("SUMMARIZE_SLO_HF_SECONDS", "5")),
+    "hf_chunked": float(os.getenv("SUMMARIZE_SLO_HF_CHUNKED_SECONDS", "60")),
+    "cohere": float(os.getenv("SUMMARIZE_SLO_COHERE_SECONDS", "10")),
+}
+MAX_ERROR_RATE = float(os.getenv("SUMMARIZE_MAX_ERROR_RATE", "0.5"))
+# the local model is saturated past this many queued batches
+HF_MAX_QUEUED_BATCHES = int(os.getenv("SUMMARIZE_HF_MAX_QUEUED_BATCHES", "4"))
+STATS_WINDOW = float(os.getenv("SUMMARIZE_STATS_WINDOW_SECONDS", "300"))
+# fewer samples than this are not enough to call a backend unhealthy
+MIN_SAMPLES = 5
+
+# end of the input items, which may contain None
+_DONE = object()
+
+
+def summarize(text: str, model: str = None, options: dict = None):
+    options = options or {}
+
+    if model == "auto":
+        return router.summarize(text, options)
+
+    if model in HUGGING_FACE_MODELS:
+        return summarize_hugging_face(
+            text,
+            min_length=int(options.get("min_length", 30)),
+            max_length=int(options.get("max_length", 130)),
+        )
+
+    return summarize_cohere(
+        text,
+        temperature=float(options.get("temperature", 0.5)),
+        length=options.get("length", "medium"),
+        format=options.get("format", "paragraph"),
+    )
+
+
+class BackendStats:
+    """Latencies and errors of a backend over the last `window` seconds."""
+
+    def __init__(self, window: float) -> None:
+        self.window = window
+        self._lock = threading.Lock()
+        # (finished_at, seconds, ok)
+        self._samples = deque()
+
+    def record(self, seconds: float, ok: bool):
+        with self._lock:
+            self._samples.append((time.time(), seconds, ok))
+
+    def _recent(self):
+        expires_at = time.time() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < expires_at:
+                self._samples.popleft()
+            return list(self._samples)
+
+    def summary(self) -> dict:
+        samples = self._recent()
+        latencies = [seconds for _, seconds, ok in samples if ok]
+        return {
+            "count": len(samples),
+            "error_rate": (
+                sum(1 for _, _, ok in samples if not ok) / len(samples)
+                if samples
+                else 0.0
+            ),
+            "p95": metrics.percentile(latencies, 0.95) if latencies else 0.0,
+        }
+
+
+class SummarizationRouter:
+    """Pick a summarization backend by text length and recent backend health.
+
+    Short texts go to the local model, texts over its input to Cohere, and
+    texts too long for Cohere to the local map-reduce. A backend over its
+    latency SLO, erroring or saturated is moved behind the others, and a
+    failing call falls over to the next candidate. Stats expire after
+    `STATS_WINDOW`, so a demoted backend is tried first again later.
+    """
+
+    def __init__(self) -> None:
+        self.stats = {backend: BackendStats(STATS_WINDOW) for backend in LATENCY_SLOS}
+
+    def count_tokens(self, text: str) -> int:
+        # don't load the model only to count, estimate from words meanwhile
+        if hugging_face.is_loaded():
+            return hugging_face.count_tokens(text)
+        return int(len(text.split()) * 4 / 3)
+
+    def get_candidates(self, text: str) -> List[str]:
+        """Backends able to summarize the text, preferred first."""
+        tokens = self.count_tokens(text)
+        max_input_tokens = (
+            hugging_face.get_max_input_tokens()
+            if hugging_face.is_loaded()
+            else HF_MAX_INPUT_TOKENS
+        )
+        if len(text) < COHERE_MIN_CHARACTERS:
+            return ["hf"]
+        if tokens <= max_input_tokens:
+            return ["hf", "cohere"]
+        if tokens <= COHERE_MAX_TOKENS:
+            return ["cohere", "hf_chunked"]
+        return ["hf_chunked"]
+
+    def is_healthy(self, backend: str) -> bool:
+        if backend in ["hf", "hf_chunked"]:
+            if batcher.queue_size() >= batcher.max_batch_size * HF_MAX_QUEUED_BATCHES:
+                return False
+        stats = self.stats[backend].summary()
+        if stats["count"] < MIN_SAMPLES:
+            return True
+        return (
+            stats["error_rate"] <= MAX_ERROR_RATE
+            and stats["p95"] <= LATENCY_SLOS[backend]
+        )
+
+    def route(self, text: str) -> List[str]:
+        candidates = self.get_candidates(text)
+        # stable sort, healthy backends keep their order in front
+        return sorted(candidates, key=lambda backend: not self.is_healthy(backend))
+
+    def call(self, backend: str, text: str, options: dict) -> str:
+        if backend == "cohere":
+            return summarize(text, "cohere", options).summary
+        output = summarize_hugging_face(
+            text,
+            min_length=int(options.get("min_length", 30)),
+            max_length=int(options.get("max_length", 130)),
+            chunked=backend == "hf_chunked",
+        )
+        return output[0]["summary_text"]
+
+    def summarize(self, text: str, options: dict = None) -> dict:
+        options = options or {}
+        error = None
+        for backend in self.route(text):
+            start = time.perf_counter()
+            try:
+                summary = self.call(backend, text, options)
+            except Exception as e:
+                traceback.print_exc()
+                self.stats[backend].record(time.perf_counter() - start, False)
+                metrics.incr(f"summarize_auto.{backend}.error")
+                error = e
+                continue
+
+            seconds = time.perf_counter() - start
+            self.stats[backend].record(seconds, True)
+            metrics.incr(f"summarize_auto.{backend}.requests")
+            metrics.observe(f"summarize_auto.{backend}.latency_seconds", seconds)
+            return {"backend": backend, "summary": summary}
+
+        raise error
+
+    def snapshot(self) -> dict:
+        return {
+            backend: {**stats.summary(), "healthy": self.is_healthy(backend)}
+            for backend, stats in self.stats.items()
+        }
+
+
+router = SummarizationRouter()
+
+
+def serialize_result(result: Any):
+    """JSON fallback for Cohere response objects."""
+    if hasattr(result, "summary"):
+        return {"id": getattr(result, "id", None), "summary": result.summary}
+    return str(result)
+
+
+def summarize_batch(
+    items: Iterable[dict], model: str = None, options: dict = None
+) -> Iterator[dict]:
+    """Summarize items of `{"id": ..., "text": ...}`, yielding results as they
+    complete.
+
+    Items with an `error` instead of a text, e.g. unparsable input lines, are
+    reported as is, every item gets exactly one result. At most `concurrency`
+    items are in flight, so items can be streamed in without reading them all
+    first. For the local model the concurrency is twice its batch size, so the
+    batcher can fill whole batches, `auto` allows the larger of both.
+    """
+    options = options or {}
+    if model in HUGGING_FACE_MODELS:
+        concurrency = batcher.max_batch_size * 2
+    elif model == "auto":
+        concurrency = max(batcher.max_batch_size * 2, COHERE_BATCH_CONCURRENCY)
+    else:
+        concurrency = COHERE_BATCH_CONCURRENCY
+
+    items = enumerate(items)
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        while True:
+            # top up the in-flight items, reporting invalid ones right away
+            while len(pending) < concurrency:
+                index, item = next(items, (None, _DONE))
+                if item is _DONE:
+                    break
+                if not isinstance(item, dict):
+                    yield {"id": index, "error": "Item must be an object!"}
+                    continue
+                id = item.get("id", index)
+                if item.get("error"):
+                    yield {"id": id, "error": item["error"]}
+                    continue
+                if not item.get("text"):
+                    yield {"id": id, "error": "Text is missing!"}
+                    continue
+                future = executor.submit(
+                    summarize,
+                    item["text"],
+                    model,
+                    {**options, **item.get("options", {})},
+                )
+                pending[future] = id
+
+            if not pending:
+                return
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                id = pending.pop(future)
+                try:
+                    yield {"id": id, "result": future.result()}
+                except Exception as e:
+                    yield {"id": id, "error": str(e)}
+    finally:
+        executor.shutdown(wait=False)
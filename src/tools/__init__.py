@@ -1,6 +1,7 @@
 import os
 import re
-from typing import Any, List, Union
+import threading
+from typing import Any, List, Tuple, Union
 
 from langchain import LLMChain, OpenAI, SerpAPIWrapper
 from langchain.agents import (
@@ -10,48 +11,32 @@ from langchain.agents import (
     Tool,
     load_tools,
 )
-from langchain.agents.agent_toolkits import NLAToolkit
-from langchain.embeddings import OpenAIEmbeddings
 from langchain.prompts import StringPromptTemplate
-from langchain.schema import AgentAction, AgentFinish, Document
+from langchain.schema import AgentAction, AgentFinish
 from langchain.tools.plugin import AIPlugin
 from langchain.utilities import PythonREPL
-from langchain.vectorstores import FAISS
 
-from ..utils.notion import query_database
-from .const import DEFAULT_TOOL_NAMES, DEFAULT_TOOLS, AI_PLUGINS
+from ..utils import metrics
+from ..utils.embedding_cache import get_embeddings
+from .cache import cached_tool
+from .const import DEFAULT_TOOL_NAMES, DEFAULT_TOOLS
 from .giphy import giphy
+from .notion_registry import notion_tool_registry
+from .plugins import get_ai_plugins, get_plugin_toolkit
+from .router import get_tool_router
 from .replicate import tools as replicate_tools
 
 CUSTOM_TOOLS = [
     giphy,
 ] + replicate_tools
 
+# (tool name, id(llm)) -> (llm, tool)
+_default_tools = {}
+_default_tools_lock = threading.Lock()
 
-def get_notion_tools() -> dict:
-    tools_dict = {}
-
-    database_id = os.getenv("PLUGINS_NOTION_DATABASE_ID", None)
-
-    if not database_id:
-        return tools_dict
-
-    result = query_database(database_id=database_id)
-    for row in result["results"]:
-        name = row["properties"]["Name"]["title"][0]["plain_text"]
-        description = row["properties"]["Description"]["rich_text"][0]["plain_text"]
-        groups = list(
-            map(
-                lambda group: group["name"], row["properties"]["Groups"]["multi_select"]
-            )
-        )
 
-        tools_dict[name] = {
-            "description": description,
-            "groups": groups,
-        }
-
-    return tools_dict
+def get_notion_tools() -> dict:
+    return notion_tool_registry.get()
 
 
 def get_available_tools() -> List[dict]:
@@ -85,23 +70,48 @@ def get_available_tools() -> List[dict]:
 
 
 def load_default_tools(tool_names: List[str], llm: any):
-    default_tools = load_tools(
-        tool_names,
-        llm=llm,
-        news_api_key=os.getenv("NEWS_API_KEY"),
-        listen_api_key=os.getenv("LISTEN_API_KEY"),
-        tmdb_bearer_token=os.getenv("TMDB_BEARER_TOKEN"),
-    )
-    tools = []
-    for tool in default_tools:
-        tools.append(
-            Tool(
-                name=tool.name,
-                func=tool.run,
-                description=tool.description,
+    """Return the default tools, building each one once per LLM on first use.
+
+    The returned tools are shared between requests and must not be mutated,
+    use `tool_view` to override a description.
+    """
+    with _default_tools_lock:
+        missing = [
+            name
+            for name in dict.fromkeys(tool_names)
+            if (name, id(llm)) not in _default_tools
+        ]
+        if missing:
+            default_tools = load_tools(
+                missing,
+                llm=llm,
+                news_api_key=os.getenv("NEWS_API_KEY"),
+                listen_api_key=os.getenv("LISTEN_API_KEY"),
+                tmdb_bearer_token=os.getenv("TMDB_BEARER_TOKEN"),
             )
-        )
-    return tools
+            for tool_name, tool in zip(missing, default_tools):
+                metrics.incr("default_tools.build")
+                # keep a reference to the LLM so its id can't be reused
+                _default_tools[(tool_name, id(llm))] = (
+                    llm,
+                    cached_tool(
+                        Tool(
+                            name=tool.name,
+                            func=tool.run,
+                            description=tool.description,
+                        ),
+                        name=tool_name,
+                    ),
+                )
+
+        return [_default_tools[(name, id(llm))][1] for name in tool_names]
+
+
+def tool_view(tool: Tool, tools_dict: dict) -> Tool:
+    """Shallow copy of a shared tool with its description from Notion."""
+    if tool.name not in tools_dict:
+        return tool
+    return tool.copy(update={"description": tools_dict[tool.name]["description"]})
 
 
 def get_tools(tool_names: List[str], llm: any):
@@ -117,57 +127,51 @@ def get_tools(tool_names: List[str], llm: any):
         else:
             for custom_tool in CUSTOM_TOOLS:
                 if tool_name == custom_tool.name:
-                    if tool_name in tools_dict:
-                        custom_tool.description = tools_dict[tool_name]["description"]
-                    tools.append(custom_tool)
+                    tools.append(tool_view(custom_tool, tools_dict))
 
     if default_tool_names:
         default_tools = load_default_tools(default_tool_names, llm)
         for tool in default_tools:
-            if tool.name in tools_dict:
-                tool.description = tools_dict[tool.name]["description"]
-            tools.append(tool)
+            tools.append(tool_view(tool, tools_dict))
 
     return tools
 
 
-def get_tools_by_query(query: str, llm: any):
-    embeddings = OpenAIEmbeddings()
-    docs = []
+def get_router_entries() -> List[Tuple[str, str]]:
+    return (
+        [
+            (plugin.name_for_model, plugin.description_for_model)
+            for plugin in get_ai_plugins()
+        ]
+        + [(tool.name, tool.description) for tool in CUSTOM_TOOLS]
+        + [(tool["name"], tool["description"]) for tool in DEFAULT_TOOLS]
+    )
 
-    tools_dict = {}
 
-    for plugin in AI_PLUGINS:
-        docs.append(
-            Document(
-                page_content=plugin.description_for_model,
-                metadata={"plugin_name": plugin.name_for_model},
-            )
-        )
-        tools_dict[plugin.name_for_model] = NLAToolkit.from_llm_and_ai_plugin(
-            llm, plugin
-        ).nla_tools
-
-    for tool in CUSTOM_TOOLS + load_default_tools(DEFAULT_TOOL_NAMES, llm):
-        docs.append(
-            Document(
-                page_content=tool.description,
-                metadata={"plugin_name": tool.name},
-            )
-        )
-        tools_dict[tool.name] = [tool]
+def warm_up_tool_router():
+    # load or build the vector index now so the fallback path is ready
+    get_tool_router(get_router_entries(), get_embeddings()).vector_store
 
-    vector_store = FAISS.from_documents(docs, embeddings)
 
-    retriever = vector_store.as_retriever()
+def get_plugin_tools(plugin_name: str, llm: any) -> List[Tool]:
+    for plugin in get_ai_plugins():
+        if plugin.name_for_model == plugin_name:
+            return get_plugin_toolkit(plugin, llm).nla_tools
+    return []
 
-    # Get documents, which contain the Plugins to use
-    result_docs = retriever.get_relevant_documents(query)
 
-    tools = []
-    for doc in result_docs:
-        tool_name = doc.metadata["plugin_name"]
-        if tool_name in tools_dict:
-            tools.extend(tools_dict[tool_name])
+def get_tools_by_query(query: str, llm: any):
+    router = get_tool_router(get_router_entries(), get_embeddings())
+
+    # Get the names of the tools and plugins to use
+    names = router.route(query)
+
+    plugin_names = [plugin.name_for_model for plugin in get_ai_plugins()]
+
+    # only instantiate the selected tools
+    tools = get_tools([name for name in names if name not in plugin_names], llm)
+    for name in names:
+        if name in plugin_names:
+            tools.extend(get_plugin_tools(name, llm))
 
     return tools
@@ -0,0 +1,54 @@
+import os
+
+from langchain.agents import Tool
+
+from ..utils import metrics
+from ..utils.cache import MemoryCache
+from .const import TOOL_CACHE_TTLS
+
+tool_cache = MemoryCache(
+    "tool_cache",
+    max_bytes=int(os.getenv("TOOL_CACHE_MAX_MB", "32")) * 1024 * 1024,
+)
+
+
+def normalize_input(tool_input: str) -> str:
+    return " ".join(str(tool_input).split()).casefold()
+
+
+def cached_tool(
+    tool: Tool,
+    name: str = None,
+    ttl: int = None,
+    include_return_direct: bool = False,
+):
+    """Wrap a tool so identical inputs are answered from the tool cache.
+
+    `name` is the `load_tools` name of the tool (e.g. "llm-math"), which keys
+    `TOOL_CACHE_TTLS`, it defaults to the tool's display name. Tools without a
+    TTL policy and `return_direct` tools, whose output is random or a new
+    prediction on every call, are returned unchanged.
+    """
+    name = name or tool.name
+    ttl = ttl if ttl is not None else TOOL_CACHE_TTLS.get(name)
+    if not ttl or (tool.return_direct and not include_return_direct):
+        return tool
+
+    def run(tool_input: str):
+        key = f"{name}:{normalize_input(tool_input)}"
+        result = tool_cache.get(key)
+        if result is not None:
+            metrics.incr(f"tool_cache.{name}.hit")
+            return result
+
+        metrics.incr(f"tool_cache.{name}.miss")
+        result = tool.func(tool_input)
+        tool_cache.set(key, result, ttl=ttl)
+        return result
+
+    return Tool(
+        name=tool.name,
+        func=run,
+        description=tool.description,
+        return_direct=tool.return_direct,
+    )
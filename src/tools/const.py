@@ -1,5 +1,3 @@
-from langchain.tools.plugin import AIPlugin
-
 # Link: https://python.langchain.com/en/latest/modules/agents/tools/getting_started.html
 
 DEFAULT_TOOLS = [
@@ -47,6 +45,15 @@ DEFAULT_TOOLS = [
 
 DEFAULT_TOOL_NAMES = [tool["name"] for tool in DEFAULT_TOOLS]
 
+# seconds to cache the output of deterministic tools for the same input
+TOOL_CACHE_TTLS = {
+    "wikipedia": 24 * 60 * 60,
+    "wolfram-alpha": 24 * 60 * 60,
+    "llm-math": 7 * 24 * 60 * 60,
+    "tmdb-api": 6 * 60 * 60,
+    "podcast-api": 6 * 60 * 60,
+}
+
 api_urls = [
     # "https://datasette.io/.well-known/ai-plugin.json",
     # "https://api.speak.com/.well-known/ai-plugin.json",
@@ -57,5 +64,3 @@ api_urls = [
     # "https://slack.com/.well-known/ai-plugin.json",
     # "https://schooldigger.com/.well-known/ai-plugin.json",
 ]
-
-AI_PLUGINS = [AIPlugin.from_url(url) for url in api_urls]
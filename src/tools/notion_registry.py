@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+import traceback
+from typing import Optional
+
+from ..utils import metrics
+from ..utils.notion import iter_database
+
+
+class NotionToolRegistry:
+    """Tool descriptions and groups from a Notion database, kept in memory.
+
+    The database is read once on first use and then refreshed by a background
+    thread every `refresh_interval` seconds, or `retry_interval` after a
+    failure. When Notion is slow or down the last known data, possibly none,
+    keeps being served.
+    """
+
+    def __init__(
+        self,
+        database_id: Optional[str],
+        refresh_interval: int = 300,
+        retry_interval: int = 30,
+    ) -> None:
+        self.database_id = database_id
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.tools = {}
+        # time the tools last changed, not the time they were last fetched
+        self.last_modified = time.time()
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _fetch(self) -> dict:
+        tools_dict = {}
+
+        for row in iter_database(database_id=self.database_id):
+            name = row["properties"]["Name"]["title"][0]["plain_text"]
+            description = row["properties"]["Description"]["rich_text"][0][
+                "plain_text"
+            ]
+            groups = list(
+                map(
+                    lambda group: group["name"],
+                    row["properties"]["Groups"]["multi_select"],
+                )
+            )
+
+            tools_dict[name] = {
+                "description": description,
+                "groups": groups,
+            }
+
+        return tools_dict
+
+    def refresh(self) -> bool:
+        """Reload the tools from Notion, return False if Notion failed."""
+        if not self.database_id:
+            return True
+
+        try:
+            tools = self._fetch()
+        except Exception:
+            traceback.print_exc()
+            metrics.incr("notion_tool_registry.error")
+            return False
+
+        metrics.incr("notion_tool_registry.refresh")
+        with self._lock:
+            if tools != self.tools:
+                self.tools = tools
+                self.last_modified = time.time()
+        return True
+
+    def get(self) -> dict:
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    # only the very first request waits for Notion, even if it
+                    # fails, the background thread retries
+                    ok = self.refresh()
+                    self._loaded = True
+                    self._start(ok)
+        return self.tools
+
+    def _start(self, ok: bool):
+        with self._lock:
+            if self._thread or not self.database_id:
+                return
+            self._thread = threading.Thread(target=self._run, args=[ok], daemon=True)
+            self._thread.start()
+
+    def _run(self, ok: bool):
+        while True:
+            time.sleep(self.refresh_interval if ok else self.retry_interval)
+            ok = self.refresh()
+
+
+notion_tool_registry = NotionToolRegistry(
+    os.getenv("PLUGINS_NOTION_DATABASE_ID", None),
+    refresh_interval=int(os.getenv("TOOLS_REFRESH_INTERVAL", "300")),
+)
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import requests
+from langchain.agents.agent_toolkits import NLAToolkit
+from langchain.tools.openapi.utils.openapi_utils import OpenAPISpec
+from langchain.tools.plugin import AIPlugin
+
+from ..utils import metrics
+from ..utils.helper import get_cache_dir
+from .const import api_urls
+
+PLUGIN_CACHE_TTL = int(os.getenv("PLUGIN_CACHE_TTL", "86400"))
+# seconds before a plugin that failed to load is tried again
+PLUGIN_RETRY_INTERVAL = int(os.getenv("PLUGIN_RETRY_INTERVAL", "60"))
+
+# url -> (loaded_at, plugin or None when it failed)
+_plugins = {}
+_toolkits = {}
+_lock = threading.Lock()
+
+
+def fetch_cached(url: str) -> str:
+    """GET a URL through a disk cache, revalidating entries older than the TTL.
+
+    A stale copy is returned when the server can't be reached.
+    """
+    path = os.path.join(
+        get_cache_dir("plugins"), hashlib.sha256(url.encode()).hexdigest() + ".json"
+    )
+    cached = None
+    if os.path.exists(path):
+        with open(path) as f:
+            cached = json.load(f)
+        if time.time() - cached["fetched_at"] < PLUGIN_CACHE_TTL:
+            metrics.incr("plugin_cache.hit")
+            return cached["body"]
+
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+
+    try:
+        response = requests.get(url, headers=headers, timeout=10)
+        if response.status_code == 304 and cached:
+            metrics.incr("plugin_cache.revalidated")
+            body = cached["body"]
+        else:
+            response.raise_for_status()
+            metrics.incr("plugin_cache.miss")
+            body = response.text
+    except Exception:
+        if not cached:
+            raise
+        traceback.print_exc()
+        metrics.incr("plugin_cache.stale")
+        return cached["body"]
+
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(
+            {
+                "url": url,
+                "body": body,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "fetched_at": time.time(),
+            },
+            f,
+        )
+    os.replace(tmp_path, path)
+    return body
+
+
+def load_plugin(url: str) -> AIPlugin:
+    return AIPlugin(**json.loads(fetch_cached(url)))
+
+
+def get_ai_plugins() -> List[AIPlugin]:
+    """Load the plugin manifests concurrently, reloading them after the TTL.
+
+    Plugins that fail to load are skipped instead of failing the app, and
+    tried again after `PLUGIN_RETRY_INTERVAL`.
+    """
+    with _lock:
+        now = time.time()
+        due = [
+            url
+            for url in api_urls
+            if url not in _plugins
+            or now - _plugins[url][0]
+            >= (PLUGIN_CACHE_TTL if _plugins[url][1] else PLUGIN_RETRY_INTERVAL)
+        ]
+
+        def load(url: str):
+            try:
+                return load_plugin(url)
+            except Exception:
+                traceback.print_exc()
+                metrics.incr("plugin_cache.error")
+                return None
+
+        if due:
+            with ThreadPoolExecutor(max_workers=min(len(due), 8)) as executor:
+                for url, plugin in zip(due, executor.map(load, due)):
+                    _plugins[url] = (now, plugin)
+
+        return [_plugins[url][1] for url in api_urls if _plugins[url][1]]
+
+
+def get_plugin_toolkit(plugin: AIPlugin, llm: any) -> NLAToolkit:
+    """NLAToolkit of a plugin, built once per LLM from the cached OpenAPI spec."""
+    key = (plugin.name_for_model, id(llm))
+    with _lock:
+        if key in _toolkits:
+            return _toolkits[key][1]
+
+    spec = OpenAPISpec.from_text(fetch_cached(plugin.api.url))
+    toolkit = NLAToolkit.from_llm_and_spec(llm, spec)
+
+    with _lock:
+        # keep a reference to the LLM so its id can't be reused
+        return _toolkits.setdefault(key, (llm, toolkit))[1]
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import List, Optional, Tuple
+
+from langchain.vectorstores import FAISS
+
+from ..utils import metrics
+from ..utils.embedding_cache import CachedEmbeddings
+from ..utils.helper import get_cache_dir
+
+
+STOP_WORDS = set(
+    """a an and are as at be but by can do for from get give how i in is it me my
+    of on or please show tell that the this to use useful want what when where
+    which who why will with you your input should question questions about top
+    some""".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        token
+        for token in re.findall(r"[a-z0-9]+", text.lower())
+        if token not in STOP_WORDS
+    ]
+
+
+class BM25Index:
+    """Small in-memory BM25 index over tool descriptions."""
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self.docs = [Counter(tokenize(text)) for text in texts]
+        self.lengths = [sum(doc.values()) for doc in self.docs]
+        self.avg_length = sum(self.lengths) / len(self.docs) if self.docs else 0
+        document_frequency = Counter()
+        for doc in self.docs:
+            document_frequency.update(doc.keys())
+        total = len(self.docs)
+        self.idf = {
+            term: math.log(1 + (total - count + 0.5) / (count + 0.5))
+            for term, count in document_frequency.items()
+        }
+
+    def score(self, query: str) -> Tuple[List[float], float]:
+        """Return the score of every document and the score of a full match.
+
+        The full match counts every query term, also those in no document
+        (weighted by the mean idf of the others), so a query matching one
+        generic term out of many gets a low confidence.
+        """
+        query_terms = set(tokenize(query))
+        terms = [term for term in query_terms if term in self.idf]
+        scores = []
+        for doc, length in zip(self.docs, self.lengths):
+            score = 0.0
+            for term in terms:
+                frequency = doc.get(term, 0)
+                if not frequency:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * length / self.avg_length)
+                score += (
+                    self.idf[term] * frequency * (self.k1 + 1) / (frequency + norm)
+                )
+            scores.append(score)
+
+        # score of a document of average length matching every term once
+        max_score = sum(self.idf[term] for term in terms)
+        if terms:
+            max_score *= len(query_terms) / len(terms)
+        return scores, max_score
+
+
+class ToolRouter:
+    """Hybrid lexical and vector router over tool descriptions.
+
+    Queries are scored with BM25 first and only embedded when the lexical
+    confidence is under `lexical_threshold`. The vector index is persisted to
+    disk, keyed by a fingerprint of the (name, description) entries and the
+    embedding model, so it's only rebuilt when the registry changes.
+    """
+
+    def __init__(
+        self,
+        entries: List[Tuple[str, str]],
+        embeddings: CachedEmbeddings,
+        directory: str,
+        top_k: int = 4,
+        lexical_threshold: float = 0.35,
+    ) -> None:
+        self.entries = entries
+        self.embeddings = embeddings
+        self.top_k = top_k
+        self.lexical_threshold = lexical_threshold
+        self.fingerprint = self.make_fingerprint(entries, embeddings.model)
+        self.path = os.path.join(directory, self.fingerprint)
+        self.lexical_index = BM25Index(
+            [f"{name} {description}" for name, description in entries]
+        )
+        self._vector_store = None
+        self._lock = threading.Lock()
+
+    @property
+    def vector_store(self) -> FAISS:
+        with self._lock:
+            if self._vector_store is None:
+                self._vector_store = self._load_or_build()
+            return self._vector_store
+
+    @staticmethod
+    def make_fingerprint(entries: List[Tuple[str, str]], model: str) -> str:
+        return hashlib.sha256(
+            json.dumps([model, sorted(entries)]).encode()
+        ).hexdigest()[:16]
+
+    def _load_or_build(self) -> FAISS:
+        if os.path.exists(self.path):
+            try:
+                vector_store = FAISS.load_local(self.path, self.embeddings)
+                metrics.incr("tool_router.load")
+                return vector_store
+            except Exception:
+                metrics.incr("tool_router.load_error")
+
+        metrics.incr("tool_router.build")
+        vector_store = FAISS.from_texts(
+            [description for _, description in self.entries],
+            self.embeddings,
+            metadatas=[{"plugin_name": name} for name, _ in self.entries],
+        )
+        vector_store.save_local(self.path)
+        return vector_store
+
+    def route_lexical(self, query: str, top_k: int = None) -> Tuple[List[str], float]:
+        """Return the best tools by BM25 and the confidence between 0 and 1."""
+        scores, max_score = self.lexical_index.score(query)
+        ranked = sorted(
+            [(score, name) for score, (name, _) in zip(scores, self.entries) if score],
+            reverse=True,
+        )[: top_k or self.top_k]
+        if not ranked or not max_score:
+            return [], 0.0
+        return [name for _, name in ranked], min(ranked[0][0] / max_score, 1.0)
+
+    def route_vector(self, query: str, top_k: int = None) -> List[str]:
+        docs = self.vector_store.similarity_search(query, k=top_k or self.top_k)
+        return [doc.metadata["plugin_name"] for doc in docs]
+
+    def route(
+        self,
+        query: str,
+        top_k: int = None,
+        lexical_threshold: Optional[float] = None,
+    ) -> List[str]:
+        if lexical_threshold is None:
+            lexical_threshold = self.lexical_threshold
+
+        names, confidence = self.route_lexical(query, top_k)
+        if names and confidence >= lexical_threshold:
+            metrics.incr("tool_router.lexical")
+            return names
+
+        metrics.incr("tool_router.vector")
+        return self.route_vector(query, top_k)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_tool_router(entries: List[Tuple[str, str]], embeddings: CachedEmbeddings):
+    """Return the shared router, rebuilding it when the entries changed."""
+    global _router
+    with _router_lock:
+        fingerprint = ToolRouter.make_fingerprint(entries, embeddings.model)
+        if _router is None or _router.fingerprint != fingerprint:
+            _router = ToolRouter(
+                entries,
+                embeddings,
+                get_cache_dir("tool_router"),
+                top_k=int(os.getenv("TOOL_ROUTER_TOP_K", "4")),
+                lexical_threshold=float(
+                    os.getenv("TOOL_ROUTER_LEXICAL_THRESHOLD", "0.35")
+                ),
+            )
+        return _router
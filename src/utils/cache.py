@@ -0,0 +1,126 @@
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from . import metrics
+
+
+def default_sizeof(value: Any) -> int:
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry TTL, bounded by total size in bytes."""
+
+    def __init__(
+        self,
+        name: str,
+        max_bytes: int,
+        sizeof: Callable[[Any], int] = default_sizeof,
+    ) -> None:
+        self.name = name
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._lock = threading.Lock()
+        # key -> (expires_at, size, value)
+        self._entries = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                metrics.incr(f"{self.name}.miss")
+                return None
+
+            expires_at, size, value = entry
+            if expires_at is not None and expires_at < time.time():
+                self._pop(key)
+                metrics.incr(f"{self.name}.miss")
+                return None
+
+            self._entries.move_to_end(key)
+            metrics.incr(f"{self.name}.hit")
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        size = len(key) + self.sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = (expires_at, size, value)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._pop(next(iter(self._entries)))
+                metrics.incr(f"{self.name}.evict")
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def _pop(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+
+class RedisCache:
+    """Cache shared between processes, values must be bytes or str.
+
+    Redis errors are counted and treated as misses, so an outage only
+    disables caching.
+    """
+
+    def __init__(self, name: str, url: str) -> None:
+        try:
+            import redis
+        except ImportError:
+            raise ValueError(
+                "Could not import redis python package. "
+                "Please it install it with `pip install redis`."
+            )
+        self.name = name
+        self.client = redis.Redis.from_url(url)
+        self.error_class = redis.RedisError
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            value = self.client.get(f"{self.name}:{key}")
+        except self.error_class:
+            traceback.print_exc()
+            metrics.incr(f"{self.name}.error")
+            value = None
+        metrics.incr(f"{self.name}.{'miss' if value is None else 'hit'}")
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        try:
+            self.client.set(f"{self.name}:{key}", value, ex=int(ttl) if ttl else None)
+        except self.error_class:
+            traceback.print_exc()
+            metrics.incr(f"{self.name}.error")
+
+    def delete(self, key: str):
+        try:
+            self.client.delete(f"{self.name}:{key}")
+        except self.error_class:
+            traceback.print_exc()
+            metrics.incr(f"{self.name}.error")
+
+
+def create_cache(name: str, max_bytes: int):
+    """Create a cache using the backend configured by CACHE_BACKEND."""
+    backend = os.getenv("CACHE_BACKEND", "memory").lower()
+    if backend == "redis":
+        return RedisCache(name, os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return MemoryCache(name, max_bytes)
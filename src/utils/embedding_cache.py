@@ -0,0 +1,127 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
+
+from . import metrics
+from .helper import get_cache_dir
+
+# sqlite limits the number of bound parameters per statement
+LOOKUP_BATCH_SIZE = 500
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingStore:
+    """SQLite store of embeddings keyed by (model, sha256 of text)."""
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, hash)
+                )"""
+            )
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+                batch = hashes[i : i + LOOKUP_BATCH_SIZE]
+                rows = self._conn.execute(
+                    "SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({})".format(
+                        ",".join("?" * len(batch))
+                    ),
+                    [model, *batch],
+                ).fetchall()
+                for hash, vector in rows:
+                    found[hash] = array("f", vector).tolist()
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, List[float]]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [
+                    (model, hash, array("f", vector).tobytes())
+                    for hash, vector in vectors.items()
+                ],
+            )
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts missing from the store upstream."""
+
+    def __init__(
+        self, embeddings: Embeddings, store: EmbeddingStore, model: Optional[str] = None
+    ) -> None:
+        self.embeddings = embeddings
+        self.store = store
+        self.model = (
+            model
+            or getattr(embeddings, "model", None)
+            or getattr(embeddings, "document_model_name", None)
+            or type(embeddings).__name__
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [hash_text(text) for text in texts]
+        found = self.store.get_many(self.model, list(set(hashes)))
+
+        # dedupe misses so each unique chunk is embedded once, in one batch
+        missing = {}
+        for hash, text in zip(hashes, texts):
+            if hash not in found and hash not in missing:
+                missing[hash] = text
+
+        metrics.incr("embedding_cache.hit", len(texts) - len(missing))
+        metrics.incr("embedding_cache.miss", len(missing))
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.store.put_many(self.model, computed)
+            found.update(computed)
+
+        return [found[hash] for hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        hash = hash_text(text)
+        found = self.store.get_many(self.model, [hash])
+        if hash in found:
+            metrics.incr("embedding_cache.hit")
+            return found[hash]
+
+        metrics.incr("embedding_cache.miss")
+        vector = self.embeddings.embed_query(text)
+        self.store.put_many(self.model, {hash: vector})
+        return vector
+
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """Shared OpenAI embeddings backed by the local embedding store."""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            store = EmbeddingStore(
+                os.path.join(get_cache_dir("embeddings"), "embeddings.sqlite3")
+            )
+            _embeddings = CachedEmbeddings(OpenAIEmbeddings(), store)
+        return _embeddings
@@ -1,6 +1,7 @@
 import os
 import json
 import random
+from functools import lru_cache
 
 
 class SafeDict(dict):
@@ -39,3 +40,28 @@ def parse_json_string(input: str) -> str:
 
 def random_number(min: int, max: int):
     return random.randint(min, max)
+
+
+def get_cache_dir(*paths: str) -> str:
+    """Return a directory under CACHE_DIR, creating it if needed."""
+    path = os.path.join(os.getenv("CACHE_DIR", ".cache"), *paths)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str = "gpt-3.5-turbo"):
+    import tiktoken
+
+    return tiktoken.encoding_for_model(model_name)
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    tokens = get_encoding().encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return get_encoding().decode(tokens[:max_tokens]) + " ...[truncated]"
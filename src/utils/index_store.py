@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, List, Optional
+
+from . import metrics
+from .helper import get_cache_dir
+
+
+class IndexStore:
+    """Persistent store of serialized vector indexes.
+
+    Indexes are keyed by a hash of the document contents and the parameters
+    used to build them, and evicted least-recently-used first once the store
+    grows beyond ``max_bytes`` or ``max_entries``.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        max_entries: int = 1000,
+        name: str = "index_store",
+    ) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.name = name
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(texts: List[str], **params: Any) -> str:
+        digest = hashlib.sha256()
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+        for text in texts:
+            # length prefix so ["ab", "c"] and ["a", "bc"] hash differently
+            data = text.encode()
+            digest.update(str(len(data)).encode() + b":")
+            digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def load(self, key: str, loader: Callable[[str], Any]) -> Optional[Any]:
+        path = self._path(key)
+        if not os.path.exists(path):
+            metrics.incr(f"{self.name}.miss")
+            return None
+
+        try:
+            index = loader(path)
+        except Exception:
+            # corrupted or incompatible entry, drop it and rebuild
+            metrics.incr(f"{self.name}.error")
+            self._remove(path)
+            return None
+
+        # bump the access time used for LRU eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        metrics.incr(f"{self.name}.hit")
+        return index
+
+    def save(self, key: str, saver: Callable[[str], Any]):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            saver(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            self._remove(tmp_path)
+        metrics.incr(f"{self.name}.save")
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for file_name in os.listdir(self.directory):
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(self.directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            entries.sort()
+            total_bytes = sum(size for _, size, _ in entries)
+            while entries and (
+                total_bytes > self.max_bytes or len(entries) > self.max_entries
+            ):
+                _, size, path = entries.pop(0)
+                self._remove(path)
+                total_bytes -= size
+                metrics.incr(f"{self.name}.evict")
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+index_store = IndexStore(
+    get_cache_dir("indexes"),
+    max_bytes=int(os.getenv("INDEX_CACHE_MAX_MB", "512")) * 1024 * 1024,
+    max_entries=int(os.getenv("INDEX_CACHE_MAX_ENTRIES", "1000")),
+)
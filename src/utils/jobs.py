@@ -0,0 +1,120 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from . import metrics
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobManager:
+    """Runs background jobs on a bounded thread pool and tracks their progress.
+
+    The job function is called with a ``progress_cb`` keyword argument which
+    it can call with a stage name every time it moves on to a new stage.
+    Finished jobs are kept for ``ttl`` seconds so clients can poll the result.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_workers: int = 4,
+        max_pending: int = 100,
+        ttl: int = 3600,
+    ) -> None:
+        self.name = name
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> str:
+        with self._lock:
+            self._expire()
+            pending = sum(
+                1
+                for job in self._jobs.values()
+                if job["status"] in ["queued", "running"]
+            )
+            if pending >= self.max_pending:
+                metrics.incr(f"{self.name}.rejected")
+                raise JobQueueFull(f"Too many pending {self.name} jobs")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "stage": None,
+                "stages": [],
+                "result": None,
+                "error": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+
+        metrics.incr(f"{self.name}.submitted")
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job:
+                return None
+            return dict(job, stages=[dict(stage) for stage in job["stages"]])
+
+    def _progress(self, job_id: str, stage: str):
+        now = time.time()
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["stages"]:
+                job["stages"][-1]["finished_at"] = now
+            job["stage"] = stage
+            job["stages"].append(
+                {"name": stage, "started_at": now, "finished_at": None}
+            )
+
+    def _finish(self, job_id: str, status: str, result: Any = None, error=None):
+        now = time.time()
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["stages"] and not job["stages"][-1]["finished_at"]:
+                job["stages"][-1]["finished_at"] = now
+            job["status"] = status
+            job["result"] = result
+            job["error"] = error
+            job["finished_at"] = now
+        metrics.incr(f"{self.name}.{status}")
+
+    def _run(self, job_id: str, fn: Callable[..., Any], args, kwargs):
+        with self._lock:
+            self._jobs[job_id]["status"] = "running"
+        try:
+            result = fn(
+                *args,
+                progress_cb=lambda stage: self._progress(job_id, stage),
+                **kwargs,
+            )
+        except Exception as e:
+            traceback.print_exc()
+            self._finish(job_id, "failed", error=str(e))
+            return
+
+        if result:
+            self._finish(job_id, "succeeded", result=result)
+        else:
+            self._finish(job_id, "failed", error="Error when processing!")
+
+    def _expire(self):
+        expired_before = time.time() - self.ttl
+        for job_id, job in list(self._jobs.items()):
+            if job["finished_at"] and job["finished_at"] < expired_before:
+                del self._jobs[job_id]
@@ -0,0 +1,59 @@
+import threading
+import time
+from collections import defaultdict, deque
+
+# recent samples kept per observed metric
+MAX_SAMPLES = 1000
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))
+
+
+def incr(name: str, value: int = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters.get(name, 0)
+
+
+def observe(name: str, value: float):
+    """Record a sample, e.g. a latency, summarized in `snapshot`."""
+    with _lock:
+        _samples[name].append((time.time(), value))
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def summarize(samples, window: float = 60.0) -> dict:
+    values = [value for _, value in samples]
+    now = time.time()
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "max": max(values),
+        # samples per second over the last `window` seconds
+        "rate": sum(1 for at, _ in samples if now - at <= window) / window,
+    }
+
+
+def snapshot() -> dict:
+    with _lock:
+        counters = dict(sorted(_counters.items()))
+        samples = {name: list(values) for name, values in _samples.items()}
+    return {
+        "counters": counters,
+        "samples": {
+            name: summarize(values)
+            for name, values in sorted(samples.items())
+            if values
+        },
+    }
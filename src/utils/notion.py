@@ -1,8 +1,14 @@
 import os
-from typing import List
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List
 
 import requests
 
+from . import metrics
+
 url_prefix = "https://api.notion.com/v1"
 
 headers = {
@@ -12,30 +18,188 @@ headers = {
     "Authorization": f"Bearer {os.getenv('NOTION_API_KEY')}",
 }
 
+MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))
+
+# Notion API limits per request
+MAX_BLOCKS_PER_REQUEST = 100
+MAX_TEXT_LENGTH = 2000
+
+
+class TokenBucket:
+    """Blocking token bucket limiting requests to `rate` per second."""
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Notion allows an average of 3 requests per second per integration
+rate_limiter = TokenBucket(rate=float(os.getenv("NOTION_RATE_LIMIT", "3")), capacity=3)
+
 
-def query_database(database_id: str, filter_data: dict = None):
-    url = f"{url_prefix}/databases/{database_id}/query"
+def request(method: str, path: str, payload: dict = None) -> dict:
+    """Send a rate limited request, retrying rate limits and server errors."""
+    for attempt in range(MAX_RETRIES + 1):
+        rate_limiter.acquire()
+        response = requests.request(
+            method, f"{url_prefix}{path}", json=payload, headers=headers, timeout=30
+        )
+        if response.status_code in [429, 502, 503, 504] and attempt < MAX_RETRIES:
+            metrics.incr(f"notion.retry_{response.status_code}")
+            retry_after = response.headers.get("Retry-After")
+            time.sleep(float(retry_after) if retry_after else 2**attempt)
+            continue
+        break
+
+    metrics.incr("notion.request")
+    return response.json()
+
+
+def iter_database(
+    database_id: str, filter_data: dict = None, page_size: int = 100
+) -> Iterator[dict]:
+    """Yield every row of a database query, following `next_cursor`."""
+    url = f"/databases/{database_id}/query"
 
     payload = {
-        "page_size": 100,
+        "page_size": page_size,
     }
     if filter_data:
         payload["filter"] = filter_data
 
-    response = requests.post(url, json=payload, headers=headers)
+    while True:
+        result = request("POST", url, payload)
+        if result.get("object") == "error":
+            raise ValueError(f"Got error from Notion: {result.get('message')}")
+
+        yield from result["results"]
+
+        if not result.get("has_more"):
+            return
+        payload["start_cursor"] = result["next_cursor"]
+
+
+def query_database(database_id: str, filter_data: dict = None, limit: int = None):
+    results = list(islice(iter_database(database_id, filter_data), limit))
+    return {"results": results}
 
-    result = response.json()
-    return result
+
+def query_databases(queries: List[dict], max_workers: int = 4) -> List[List[dict]]:
+    """Run independent queries in parallel and return the rows of each.
+
+    Each query is a dict of `iter_database` arguments, all requests still
+    share the same rate limit.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(lambda query: list(iter_database(**query)), queries)
+        )
 
 
 def create_page(parent: dict, properties: dict, children: List[dict]):
-    url = f"{url_prefix}/pages"
     payload = {
         "parent": parent,
         "properties": properties,
         "children": children,
     }
 
-    response = requests.post(url, json=payload, headers=headers)
-    result = response.json()
+    return request("POST", "/pages", payload)
+
+
+def append_block_children(block_id: str, children: List[dict]):
+    return request("PATCH", f"/blocks/{block_id}/children", {"children": children})
+
+
+def archive_page(page_id: str):
+    return request("PATCH", f"/pages/{page_id}", {"archived": True})
+
+
+def split_text(text: str, max_length: int = MAX_TEXT_LENGTH) -> List[str]:
+    """Split text in parts under `max_length`, on whitespace when possible."""
+    parts = []
+    while len(text) > max_length:
+        cut = text.rfind(" ", 0, max_length)
+        if cut <= 0:
+            cut = max_length
+        parts.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+def text_to_blocks(text: str) -> Iterator[dict]:
+    """Yield one paragraph block per line, splitting lines over Notion's limit."""
+    for line in text.split("\n"):
+        for part in split_text(line):
+            yield {
+                "object": "block",
+                "type": "paragraph",
+                "paragraph": {
+                    "rich_text": [
+                        {
+                            "type": "text",
+                            "text": {
+                                "content": part,
+                            },
+                        }
+                    ]
+                },
+            }
+
+
+def create_page_with_blocks(parent: dict, properties: dict, blocks: Iterable[dict]):
+    """Create a page with any number of blocks.
+
+    The page is created with the first batch and the rest is appended in
+    batches of `MAX_BLOCKS_PER_REQUEST`, in order. If an append fails the
+    page is archived, so a truncated page is never found as complete.
+    """
+    start = time.monotonic()
+    blocks = iter(blocks)
+    batches = iter(lambda: list(islice(blocks, MAX_BLOCKS_PER_REQUEST)), [])
+
+    first_batch = next(batches, [])
+    result = create_page(parent, properties, first_batch)
+    if result.get("object") == "error":
+        return result
+    count = len(first_batch)
+
+    try:
+        for batch in batches:
+            response = append_block_children(result["id"], batch)
+            if response.get("object") == "error":
+                archive_page(result["id"])
+                return response
+            count += len(batch)
+    except Exception:
+        archive_page(result["id"])
+        raise
+
+    elapsed = time.monotonic() - start
+    print(
+        "Uploaded {} blocks to Notion page {} in {:.2f}s ({:.1f} blocks/s)".format(
+            count,
+            result["id"],
+            elapsed,
+            count / elapsed if elapsed else 0,
+        )
+    )
     return result
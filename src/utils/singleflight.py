@@ -0,0 +1,50 @@
+import threading
+from typing import Any, Callable, Hashable
+
+from . import metrics
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single execution.
+
+    The first caller for a key runs the function, every caller arriving while
+    it is in flight waits for it and gets the same result (or exception).
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr(f"{self.name}.shared")
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        metrics.incr(f"{self.name}.executed")
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from . import metrics
+from .helper import get_cache_dir
+
+TRACKING_PARAMS = ["fbclid", "gclid", "ref", "ref_src"]
+
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so trivially different links map to the same key."""
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    parts = urlsplit(url)
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith("utm_") and key not in TRACKING_PARAMS
+    )
+    netloc = parts.netloc.lower()
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            netloc,
+            parts.path.rstrip("/"),
+            urlencode(query),
+            "",
+        )
+    )
+
+
+class UrlIndex:
+    """Local SQLite map of normalized URL -> Notion page id and content hash."""
+
+    def __init__(self, path: str) -> None:
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY,
+                    page_id TEXT NOT NULL,
+                    content_hash TEXT,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+
+    def get(self, url: str) -> Optional[Tuple[str, Optional[str]]]:
+        """Return (page id, content hash) of a URL, if known."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_id, content_hash FROM urls WHERE url = ?",
+                [normalize_url(url)],
+            ).fetchone()
+        metrics.incr(f"url_index.{'hit' if row else 'miss'}")
+        return row
+
+    def put(self, url: str, page_id: str, content_hash: Optional[str] = None):
+        self.put_many([(url, page_id, content_hash)])
+
+    def put_many(self, items: Iterable[Tuple[str, str, Optional[str]]]):
+        now = time.time()
+        with self._lock, self._conn:
+            # keep a known content hash when the new entry doesn't have one
+            self._conn.executemany(
+                """INSERT INTO urls (url, page_id, content_hash, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    page_id = excluded.page_id,
+                    content_hash = COALESCE(excluded.content_hash, urls.content_hash),
+                    updated_at = excluded.updated_at""",
+                [
+                    (normalize_url(url), page_id, content_hash, now)
+                    for url, page_id, content_hash in items
+                ],
+            )
+
+
+url_index = UrlIndex(os.path.join(get_cache_dir("notion"), "urls.sqlite3"))
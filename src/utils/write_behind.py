@@ -0,0 +1,171 @@
+import json
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Any, Callable, Optional
+
+from . import metrics
+
+
+class WriteBehindQueue:
+    """Durable queue of tasks processed by a background thread.
+
+    Tasks are stored in SQLite, so they survive restarts, and are keyed so
+    the same task is only queued once. Every process sharing the file runs a
+    worker, a task is claimed with a lease before it runs so only one of them
+    handles it, and a lease that expires (e.g. the process died) puts the task
+    back. A failing task is retried with exponential backoff until
+    `max_attempts`, then kept as failed.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        handler: Callable[[Any], Any],
+        max_attempts: int = 8,
+        poll_interval: float = 1.0,
+        lease_seconds: float = 600,
+    ) -> None:
+        self.name = name
+        self.handler = handler
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS tasks (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    lease_until REAL
+                )"""
+            )
+            columns = [
+                row[1] for row in self._conn.execute("PRAGMA table_info(tasks)")
+            ]
+            if "lease_until" not in columns:
+                self._conn.execute("ALTER TABLE tasks ADD COLUMN lease_until REAL")
+
+    def enqueue(self, key: str, payload: Any) -> bool:
+        """Queue a task, return False if a task with this key is pending already.
+
+        A task that failed for good is queued again.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                """INSERT INTO tasks (key, payload, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    payload = excluded.payload,
+                    status = 'pending',
+                    attempts = 0,
+                    next_attempt_at = excluded.next_attempt_at
+                WHERE tasks.status = 'failed'""",
+                [key, json.dumps(payload), now, now],
+            )
+        added = cursor.rowcount > 0
+        if added:
+            metrics.incr(f"{self.name}.enqueued")
+        self.start()
+        self._wakeup.set()
+        return added
+
+    def pending(self, key: str) -> Optional[Any]:
+        """Return the payload of a task that hasn't been processed yet."""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT payload FROM tasks
+                WHERE key = ? AND status IN ('pending', 'running')""",
+                [key],
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _next_task(self):
+        """Claim the next due task, return None when there is none."""
+        with self._lock, self._conn:
+            now = time.time()
+            # tasks of workers that died while running them
+            self._conn.execute(
+                """UPDATE tasks SET status = 'pending', lease_until = NULL
+                WHERE status = 'running' AND lease_until < ?""",
+                [now],
+            )
+            while True:
+                task = self._conn.execute(
+                    """SELECT key, payload, attempts FROM tasks
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at LIMIT 1""",
+                    [now],
+                ).fetchone()
+                if not task:
+                    return None
+                # another process may have claimed it since the select
+                cursor = self._conn.execute(
+                    """UPDATE tasks SET status = 'running', lease_until = ?
+                    WHERE key = ? AND status = 'pending'""",
+                    [now + self.lease_seconds, task[0]],
+                )
+                if cursor.rowcount == 1:
+                    return task
+
+    def _run(self):
+        while True:
+            try:
+                self._run_once()
+            except Exception:
+                # e.g. the database is locked, keep the worker alive
+                traceback.print_exc()
+                metrics.incr(f"{self.name}.worker_error")
+                time.sleep(self.poll_interval)
+
+    def _run_once(self):
+        task = self._next_task()
+        if not task:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            return
+
+        key, payload, attempts = task
+        try:
+            self.handler(json.loads(payload))
+        except Exception as e:
+            traceback.print_exc()
+            attempts += 1
+            failed = attempts >= self.max_attempts
+            status = "failed" if failed else "pending"
+            metrics.incr(f"{self.name}.{'failed' if failed else 'retry'}")
+            with self._lock, self._conn:
+                self._conn.execute(
+                    """UPDATE tasks SET status = ?, attempts = ?, lease_until = NULL,
+                    next_attempt_at = ?, last_error = ? WHERE key = ?""",
+                    [
+                        status,
+                        attempts,
+                        time.time() + min(2**attempts * 5, 3600),
+                        repr(e),
+                        key,
+                    ],
+                )
+            return
+
+        metrics.incr(f"{self.name}.done")
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tasks WHERE key = ?", [key])
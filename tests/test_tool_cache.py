@@ -0,0 +1,32 @@
+from langchain.agents import Tool
+
+from src.tools.cache import cached_tool, tool_cache
+from src.utils import metrics
+
+
+def test_second_identical_call_is_a_hit():
+    calls = []
+
+    def calculate(tool_input: str):
+        calls.append(tool_input)
+        return "Answer: 4"
+
+    # load_tools names this tool "Calculator", its TTL is keyed by "llm-math"
+    tool = cached_tool(
+        Tool(name="Calculator", func=calculate, description="Math."),
+        name="llm-math",
+    )
+    tool_cache.delete("llm-math:2 + 2")
+    hits = metrics.get("tool_cache.llm-math.hit")
+
+    assert tool.run("2 + 2") == "Answer: 4"
+    assert tool.run("  2  +  2 ") == "Answer: 4"
+
+    assert calls == ["2 + 2"]
+    assert metrics.get("tool_cache.llm-math.hit") == hits + 1
+
+
+def test_tool_without_ttl_is_not_wrapped():
+    tool = Tool(name="Calculator", func=lambda x: x, description="Math.")
+
+    assert cached_tool(tool) is tool